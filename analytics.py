@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+import os
+import copy
+import json
+import argparse
+import bisect
+import tempfile
+
+from datetime import datetime
+
+import ledger, logs
+
+logger = logs.get_logger(__name__)
+
+ANALYTICS_FILE = 'analytics.json'
+
+
+def trade_day(trade):
+    return datetime.utcfromtimestamp(trade['transactTime'] / 1000).strftime('%Y-%m-%d')
+
+
+def summarise_fills(fills):
+    # Base quantity, quote spent (sum of price * qty) and commission per asset across the fills of one order
+    base = 0
+    quote = 0
+    fees = {}
+    for fill in fills:
+        qty = float(fill['qty'])
+        base += qty
+        quote += float(fill['price']) * qty
+        asset = fill.get('commissionAsset', '?')
+        fees[asset] = fees.get(asset, 0) + float(fill['commission'])
+    return base, quote, fees
+
+
+def empty_totals():
+    return {'trades': 0, 'base': 0.0, 'quote': 0.0, 'fees': {}}
+
+
+def add_totals(totals, trades, base, quote, fees):
+    totals['trades'] += trades
+    totals['base'] += base
+    totals['quote'] += quote
+    for asset, amount in fees.items():
+        totals['fees'][asset] = totals['fees'].get(asset, 0) + amount
+
+
+class Analytics:
+    """Per-symbol running totals of everything bought, folded in as each fill is recorded.
+
+    Totals are kept cumulatively per UTC day, so any date range is the difference of two entries
+    found by binary search. VWAP is total quote spent over total base bought.
+
+    Each fill only appends its delta to a journal next to the totals file. The journal is replayed on
+    load and folded into the totals file by compact(), which the bot runs on start and shutdown.
+    """
+
+    def __init__(self, path=ANALYTICS_FILE, trade_ledger=None, deltas_path=None):
+        self.path = path
+        self.deltas_path = os.path.splitext(path)[0] + '.deltas.jsonl' if deltas_path is None else deltas_path
+        self.ledger = ledger.get_ledger() if trade_ledger is None else trade_ledger
+        # symbol -> {'days': [sorted YYYY-MM-DD], 'cumulative': [totals up to and including that day]}
+        self.symbols = {}
+        self.ledger_offset = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+            self.symbols = saved['symbols']
+            self.ledger_offset = saved['ledger_offset']
+        except (FileNotFoundError, ValueError, KeyError):
+            self.symbols = {}
+            self.ledger_offset = -1
+        self._replay()
+        # Anything recorded in the ledger but not here (e.g. a crash between the two writes) needs a rebuild
+        if self.ledger_offset != self.ledger.offset:
+            self.rebuild()
+
+    def _replay(self):
+        # Deltas after the totals file's ledger offset. Older ones are left from a compaction interrupted
+        # between its two writes. A partly written last line stops the replay, and the offset mismatch rebuilds.
+        try:
+            with open(self.deltas_path) as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        break
+                    delta = json.loads(line)
+                    if delta['ledger_offset'] > self.ledger_offset:
+                        self._add(delta['symbol'], delta['day'], delta['base'], delta['quote'], delta['fees'])
+                        self.ledger_offset = delta['ledger_offset']
+        except FileNotFoundError:
+            pass
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'ledger_offset': self.ledger_offset, 'symbols': self.symbols}, f)
+        os.replace(tmp_path, self.path)
+        # Everything in the journal is in the totals file now
+        open(self.deltas_path, 'w').close()
+
+    def compact(self):
+        # Folds the journal into the totals file. This rewrites every total, so it runs on start and
+        # shutdown rather than on each fill.
+        if os.path.exists(self.deltas_path) and os.path.getsize(self.deltas_path):
+            self.save()
+
+    def record(self, trade):
+        # Called once the trade is in the ledger. If it's already been folded in by a rebuild, there's nothing to do.
+        if self.ledger_offset == self.ledger.offset:
+            return
+        base, quote, fees = summarise_fills(trade['fills'])
+        day = trade_day(trade)
+        self._add(trade['symbol'], day, base, quote, fees)
+        self.ledger_offset = self.ledger.offset
+        # One short line per fill, however long the history. No fsync: a lost delta is rebuilt from the ledger.
+        with open(self.deltas_path, 'a') as f:
+            f.write(json.dumps({'ledger_offset': self.ledger_offset, 'symbol': trade['symbol'], 'day': day,
+                                'base': base, 'quote': quote, 'fees': fees}) + '\n')
+
+    def _add(self, symbol_name, day, base, quote, fees):
+        symbol = self.symbols.setdefault(symbol_name, {'days': [], 'cumulative': []})
+        days, cumulative = symbol['days'], symbol['cumulative']
+        i = bisect.bisect_left(days, day)
+        if i == len(days) or days[i] != day:
+            previous = cumulative[i - 1] if i > 0 else empty_totals()
+            days.insert(i, day)
+            cumulative.insert(i, copy.deepcopy(previous))
+        # Trades normally land on the last day, but a late one has to be carried through every later day
+        for totals in cumulative[i:]:
+            add_totals(totals, 1, base, quote, fees)
+
+    def rebuild(self):
+        # Flatten every fill in the ledger into arrays and total them per (symbol, day) in one pass.
+        # numpy is only needed here, so reports and the bot don't pay for importing it otherwise.
+        import numpy as np
+        symbols, days, bases, quotes, fee_assets, fee_amounts, trade_counts = [], [], [], [], [], [], []
+        for trade in self.ledger.trades():
+            if 'fills' not in trade or 'transactTime' not in trade:
+                continue
+            day = trade_day(trade)
+            for n, fill in enumerate(trade['fills']):
+                symbols.append(trade['symbol'])
+                days.append(day)
+                bases.append(float(fill['qty']))
+                quotes.append(float(fill['price']) * float(fill['qty']))
+                fee_assets.append(fill.get('commissionAsset', '?'))
+                fee_amounts.append(float(fill['commission']))
+                trade_counts.append(1 if n == 0 else 0)
+        self.symbols = {}
+        if symbols:
+            keys = np.char.add(np.char.add(np.array(symbols), '|'), np.array(days))
+            groups, group_index = np.unique(keys, return_inverse=True)
+            base_totals = np.bincount(group_index, weights=bases)
+            quote_totals = np.bincount(group_index, weights=quotes)
+            trade_totals = np.bincount(group_index, weights=trade_counts)
+            fee_assets = np.array(fee_assets)
+            fee_totals = {asset: np.bincount(group_index, weights=np.where(fee_assets == asset, fee_amounts, 0),
+                                             minlength=len(groups))
+                          for asset in np.unique(fee_assets)}
+            # np.unique sorts the keys, so each symbol's days come out in order
+            for g, key in enumerate(groups):
+                symbol_name, day = key.split('|')
+                symbol = self.symbols.setdefault(symbol_name, {'days': [], 'cumulative': []})
+                totals = copy.deepcopy(symbol['cumulative'][-1]) if symbol['cumulative'] else empty_totals()
+                add_totals(totals, int(trade_totals[g]), float(base_totals[g]), float(quote_totals[g]),
+                           {str(asset): float(amounts[g]) for asset, amounts in fee_totals.items() if amounts[g]})
+                symbol['days'].append(day)
+                symbol['cumulative'].append(totals)
+        self.ledger_offset = self.ledger.offset
+        self.save()
+        logger.debug(f'Rebuilt analytics for {len(self.symbols)} symbols from the trade ledger')
+
+    def query(self, symbol, start=None, end=None):
+        # Totals for `symbol` between the `start` and `end` days (YYYY-MM-DD, inclusive)
+        totals = empty_totals()
+        if symbol not in self.symbols:
+            return totals
+        days, cumulative = self.symbols[symbol]['days'], self.symbols[symbol]['cumulative']
+        upper = bisect.bisect_right(days, end) - 1 if end is not None else len(days) - 1
+        lower = bisect.bisect_left(days, start) - 1 if start is not None else -1
+        if upper < 0 or upper <= lower:
+            return totals
+        totals = copy.deepcopy(cumulative[upper])
+        if lower >= 0:
+            before = cumulative[lower]
+            add_totals(totals, -before['trades'], -before['base'], -before['quote'],
+                       {asset: -amount for asset, amount in before['fees'].items()})
+        totals['vwap'] = totals['quote'] / totals['base'] if totals['base'] else None
+        return totals
+
+
+_analytics = None
+
+
+def get_analytics():
+    global _analytics
+    if _analytics is None:
+        _analytics = Analytics()
+    return _analytics
+
+
+def use_temporary_files():
+    # Points the ledger and analytics at a new temporary directory, so trades the benchmark and simulator
+    # make against the fake exchange stay out of the real ones. Returns the directory.
+    global _analytics
+    directory = tempfile.mkdtemp()
+    ledger._ledger = ledger.Ledger(path=os.path.join(directory, 'trades.jsonl'),
+                                   index_path=os.path.join(directory, 'trades.index.json'),
+                                   legacy_path=os.path.join(directory, 'trades.json'))
+    _analytics = Analytics(path=os.path.join(directory, 'analytics.json'))
+    return directory
+
+
+def add_report_arguments(parser):
+    parser.add_argument('--symbol', nargs='+', help='Symbols to report on (default: all)')
+    parser.add_argument('--from', dest='start', help='First day to include, YYYY-MM-DD')
+    parser.add_argument('--to', dest='end', help='Last day to include, YYYY-MM-DD')
+    parser.add_argument('--rebuild', action='store_true', help='Recalculate everything from the ledger first')
+
+
+def report(args):
+    analytics = get_analytics()
+    if args.rebuild:
+        analytics.rebuild()
+    print(f"{'symbol':>10} {'trades':>7} {'bought':>16} {'spent':>14} {'VWAP':>14}  fees")
+    for symbol in args.symbol or sorted(analytics.symbols):
+        totals = analytics.query(symbol, args.start, args.end)
+        vwap = f"{totals['vwap']:.8f}" if totals.get('vwap') else '-'
+        fees = ', '.join(f'{amount:.8f} {asset}' for asset, amount in sorted(totals['fees'].items()))
+        print(f"{symbol:>10} {totals['trades']:>7} {totals['base']:>16.8f} {totals['quote']:>14.2f} {vwap:>14}  {fees}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report cost basis and fees from the trade ledger.')
+    add_report_arguments(parser)
+    logs.setup()
+    report(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""Replay DCA schedules against historical klines.
+
+Kline files are Binance's public kline dumps (CSV, with or without a header row) or a Parquet file
+with `open_time` and `open` columns. Each tick follows the same rules as the live scheduler:
+oversized amounts are split into minimum-sized ticks, small amounts are buffered (to 8 decimal
+places like Wallet) until they reach the minimum order value, and trades that fall in the
+savings lock window are executed once it lifts. Failed trades are not simulated.
+"""
+import argparse
+import itertools
+import numpy as np
+
+from datetime import datetime, timezone
+
+import binance, config, utils
+
+SECONDS_IN_DAY = 24 * 60 * 60
+# Savings lock window from binance.savings_lock_check, as seconds of the UTC day
+LOCK_START = 23 * 60 * 60 + 48 * 60
+LOCK_END = 10 * 60
+LOCK_RESUME = 10 * 60 + 30
+
+
+def load_klines(path):
+    # Returns (open time in epoch seconds, open price) arrays sorted by time
+    if path.endswith('.parquet'):
+        try:
+            import pandas
+        except ImportError:
+            raise ImportError('Reading Parquet klines requires pandas and pyarrow to be installed')
+        frame = pandas.read_parquet(path, columns=['open_time', 'open'])
+        open_times = frame['open_time'].to_numpy(dtype=np.float64)
+        prices = frame['open'].to_numpy(dtype=np.float64)
+    else:
+        with open(path) as f:
+            has_header = not f.readline().split(',')[0].strip().isdigit()
+        data = np.loadtxt(path, delimiter=',', usecols=(0, 1), skiprows=int(has_header), ndmin=2)
+        open_times, prices = data[:, 0], data[:, 1]
+    # Binance dumps are in milliseconds (microseconds from 2025 onwards)
+    open_times = open_times / np.where(open_times > 1e14, 1e6, 1e3)
+    order = np.argsort(open_times, kind='stable')
+    return open_times[order], prices[order]
+
+
+def ticks_per_trade(tick_amount, minimum_order_value):
+    # Smallest number of ticks whose (rounded) buffered total reaches the minimum order value
+    n = max(int(np.ceil(minimum_order_value / tick_amount)), 1)
+    while n > 1 and round((n - 1) * tick_amount, 8) >= minimum_order_value:
+        n -= 1
+    while round(n * tick_amount, 8) < minimum_order_value:
+        n += 1
+    return n
+
+
+def delay_for_savings_lock(times):
+    seconds_of_day = np.mod(times, SECONDS_IN_DAY)
+    before_midnight = seconds_of_day >= LOCK_START
+    after_midnight = seconds_of_day <= LOCK_END
+    delayed = times.copy()
+    delayed[before_midnight] += SECONDS_IN_DAY - seconds_of_day[before_midnight] + LOCK_RESUME
+    delayed[after_midnight] += LOCK_RESUME - seconds_of_day[after_midnight]
+    return delayed
+
+
+def simulate(open_times, prices, amount, interval, start=None, end=None,
+             trading_fee=config.TRADING_FEE,
+             minimum_order_value=binance.MINIMUM_ORDER_VALUE):
+    start = open_times[0] if start is None else start
+    end = open_times[-1] if end is None else end
+    # Reduce oversized DCA schedules to the minimum allowed order size, as Schedule does
+    min_tick_denominator = 1
+    if amount > minimum_order_value:
+        min_tick_denominator = amount / minimum_order_value
+    tick_amount = amount / min_tick_denominator
+    tick_seconds = utils.parse_timedelta_string(interval).total_seconds() / min_tick_denominator
+
+    tick_count = int(np.floor((end - start) / tick_seconds)) + 1
+    n = ticks_per_trade(tick_amount, minimum_order_value)
+    trade_ticks = np.arange(n - 1, tick_count, n)
+    order_value = round(n * tick_amount, 8)
+
+    trade_times = delay_for_savings_lock(start + trade_ticks * tick_seconds)
+    price_index = np.searchsorted(open_times, trade_times, side='right') - 1
+    in_range = (price_index >= 0) & (trade_times <= end)
+    trade_times = trade_times[in_range]
+    fill_prices = prices[price_index[in_range]]
+
+    quote_spent = np.full(fill_prices.shape, order_value)
+    quantities = quote_spent / fill_prices
+    holdings = float(quantities.sum())
+    total_quote = float(quote_spent.sum())
+    # Holdings are valued at the last price at or before `end`, not the end of the data
+    end_price = float(prices[max(np.searchsorted(open_times, end, side='right') - 1, 0)])
+    return {'amount': amount,
+            'interval': interval,
+            'trades': len(fill_prices),
+            'total_quote': total_quote,
+            'fees': total_quote * trading_fee,
+            'holdings': holdings,
+            'cost_basis': total_quote / holdings if holdings else None,
+            'value': holdings * end_price,
+            'buffered': round(int(tick_count - trade_ticks[-1] - 1 if len(trade_ticks) else tick_count)
+                              * tick_amount, 8),
+            'first_trade': datetime.utcfromtimestamp(trade_times[0]) if len(trade_times) else None,
+            'last_trade': datetime.utcfromtimestamp(trade_times[-1]) if len(trade_times) else None}
+
+
+def sweep(open_times, prices, amounts, intervals, **kwargs):
+    return [simulate(open_times, prices, amount, interval, **kwargs)
+            for amount, interval in itertools.product(amounts, intervals)]
+
+
+def parse_date(date_string):
+    return datetime.strptime(date_string, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backtest DCA schedules against historical klines.')
+    parser.add_argument('klines', help='Kline CSV or Parquet file')
+    parser.add_argument('--amount', type=float, nargs='+', required=True)
+    parser.add_argument('--interval', nargs='+', required=True)
+    parser.add_argument('--start', type=parse_date, help='YYYY-MM-DD')
+    parser.add_argument('--end', type=parse_date, help='YYYY-MM-DD')
+    args = parser.parse_args()
+
+    open_times, prices = load_klines(args.klines)
+    results = sweep(open_times, prices, args.amount, args.interval, start=args.start, end=args.end)
+    print(f"{'amount':>10} {'interval':>10} {'trades':>7} {'spent':>12} {'fees':>10} "
+          f"{'holdings':>14} {'cost basis':>12} {'value':>12}")
+    for r in sorted(results, key=lambda r: r['value'] - r['total_quote'], reverse=True):
+        cost_basis = f"{r['cost_basis']:.4f}" if r['cost_basis'] else '-'
+        print(f"{r['amount']:>10} {r['interval']:>10} {r['trades']:>7} {r['total_quote']:>12.2f} "
+              f"{r['fees']:>10.4f} {r['holdings']:>14.8f} {cost_basis:>12} {r['value']:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""Run concurrent schedules against the local fake exchange and report hot path performance.
+
+Reports tick latency percentiles, requests per trade and event loop stall time, with --startup
+the cold start time of the CLI commands, or with --store the memory, tick CPU and state save cost
+per schedule of the scheduler's schedule store. Thresholds can be given to fail (exit code 1) when a
+change makes things slower.
+"""
+import argparse
+import asyncio
+import logging
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+from os import path
+
+import binance, governor, analytics, logs
+from scheduler import Schedule, Scheduler
+from fake_exchange import FakeExchange
+
+STALL_PROBE_INTERVAL = 0.01
+# CLI commands whose cold start is measured. None of them trade or send anything.
+STARTUP_COMMANDS = (['--help'], ['status'], ['report'])
+
+
+async def probe_event_loop(stalls):
+    # Anything the probe oversleeps by is time the loop spent blocked on something else
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(STALL_PROBE_INTERVAL)
+        stalls.append(time.perf_counter() - started - STALL_PROBE_INTERVAL)
+
+
+class TimedScheduler(Scheduler):
+    def __init__(self, schedules):
+        super().__init__(schedules)
+        self.tick_latencies = []
+
+    async def _tick(self, schedules):
+        started = time.perf_counter()
+        delays = await super()._tick(schedules)
+        self.tick_latencies.extend([time.perf_counter() - started] * len(schedules))
+        return delays
+
+
+async def run_benchmark(args):
+    exchange = FakeExchange(latency=args.latency, latency_jitter=args.jitter, error_rate=args.error_rate,
+                            weight_limit=args.weight_limit)
+    binance.BASE_URL = await exchange.start()
+    # Pace requests to the fake exchange's limits rather than Binance's, so tick latency is the hot path and
+    # not time queued for Binance's order rate limit, which the fake exchange doesn't have
+    governor.governor = governor.RequestGovernor(api_weight_per_minute=args.weight_limit,
+                                                 sapi_weight_per_minute=args.weight_limit,
+                                                 orders_per_10_seconds=None)
+    # The benchmark shouldn't wait out the real savings lock window
+    binance.savings_lock_check = lambda: (False, None)
+    exchange.spot['GBP'] = exchange.earn['GBP'] = 10 ** 9
+    exchange.earn['BNB'] = 10 ** 6
+
+    schedules = [Schedule(f'C{i}', 'GBP', args.amount, args.interval) for i in range(args.schedules)]
+    scheduler = TimedScheduler(schedules)
+    stalls = []
+    probe = asyncio.ensure_future(probe_event_loop(stalls))
+    try:
+        await asyncio.wait_for(scheduler.run(), args.duration)
+    except asyncio.TimeoutError:
+        pass
+    probe.cancel()
+    # Let in-flight ticks finish so they're counted
+    if scheduler.tasks:
+        await asyncio.wait(scheduler.tasks)
+    await binance.close_session()
+    await exchange.stop()
+    return scheduler.tick_latencies, stalls, exchange
+
+
+def report(tick_latencies, stalls, exchange):
+    latencies_ms = np.array(tick_latencies) * 1000
+    stalls_ms = np.array(stalls) * 1000
+    trades = len(exchange.orders)
+    requests = sum(exchange.request_counts.values())
+    results = {'ticks': len(latencies_ms),
+               'trades': trades,
+               'requests': requests,
+               'requests_per_trade': requests / trades if trades else float('inf'),
+               'redemptions': len(exchange.redemptions),
+               'p50_ms': float(np.percentile(latencies_ms, 50)) if len(latencies_ms) else 0,
+               'p95_ms': float(np.percentile(latencies_ms, 95)) if len(latencies_ms) else 0,
+               'p99_ms': float(np.percentile(latencies_ms, 99)) if len(latencies_ms) else 0,
+               'max_ms': float(latencies_ms.max()) if len(latencies_ms) else 0,
+               'stall_p99_ms': float(np.percentile(stalls_ms, 99)) if len(stalls_ms) else 0,
+               'stall_max_ms': float(stalls_ms.max()) if len(stalls_ms) else 0}
+    for name, value in results.items():
+        print(f'{name:>20}: {round(value, 3)}')
+    for endpoint, count in sorted(exchange.request_counts.items()):
+        print(f'{endpoint:>45}: {count}')
+    return results
+
+
+def measure_startup(runs):
+    # Best of `runs` wall clock times for a fresh interpreter, from a scratch directory so nothing real is read or written
+    cli_path = path.join(path.dirname(path.abspath(__file__)), 'cli.py')
+    workdir = tempfile.mkdtemp()
+    results = {}
+    for command in STARTUP_COMMANDS:
+        times = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, cli_path] + command, cwd=workdir, capture_output=True)
+            times.append(time.perf_counter() - started)
+        results[' '.join(command)] = min(times) * 1000
+    for name, value in results.items():
+        print(f'{name:>20}: {round(value, 1)}ms')
+    return results
+
+
+def measure_store(count):
+    # Memory held per schedule once added to a scheduler, CPU per schedule to tick a batch of all of them,
+    # vectorized against one Schedule.prepare at a time, and time per schedule to save the state snapshot
+    Scheduler([Schedule('WARMUP', 'GBP', 1, '1h')])
+    tracemalloc.start()
+    scheduler = Scheduler([Schedule(f'C{i}', 'GBP', 0.25, '1h') for i in range(count)])
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    schedules = list(scheduler.schedules.values())
+    started = time.perf_counter()
+    scheduler._prepare(schedules)
+    vectorized = time.perf_counter() - started
+    started = time.perf_counter()
+    for schedule in schedules:
+        schedule.prepare()
+    one_at_a_time = time.perf_counter() - started
+    scheduler.state_path = path.join(tempfile.mkdtemp(), 'state.json')
+    started = time.perf_counter()
+    scheduler.save_state()
+    save = time.perf_counter() - started
+    results = {'bytes_per_schedule': allocated / count,
+               'tick_us_per_schedule': vectorized / count * 10 ** 6,
+               'prepare_us_per_schedule': one_at_a_time / count * 10 ** 6,
+               'save_us_per_schedule': save / count * 10 ** 6}
+    for name, value in results.items():
+        print(f'{name:>24}: {round(value, 3)}')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the trade hot path against a local fake exchange.')
+    parser.add_argument('--schedules', type=int, default=50)
+    parser.add_argument('--amount', type=float, default=10)
+    parser.add_argument('--interval', default='2s')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds to run the scheduler for')
+    parser.add_argument('--latency', type=float, default=0.02, help='Fake exchange response latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--weight-limit', type=int, default=10 ** 6,
+                        help='Request weight per minute the fake exchange allows (and the benchmark paces to)')
+    parser.add_argument('--max-p95-ms', type=float, help='Fail if p95 tick latency exceeds this')
+    parser.add_argument('--max-requests-per-trade', type=float, help='Fail if requests per trade exceeds this')
+    parser.add_argument('--max-stall-ms', type=float, help='Fail if the longest event loop stall exceeds this')
+    parser.add_argument('--verbose', action='store_true', help='Keep logging (and Telegram alerts) enabled')
+    parser.add_argument('--startup', action='store_true', help='Measure CLI cold start times instead')
+    parser.add_argument('--startup-runs', type=int, default=5)
+    parser.add_argument('--max-startup-ms', type=float, help='Fail if any CLI command takes longer than this to start')
+    parser.add_argument('--store', type=int, metavar='SCHEDULES',
+                        help='Measure memory, tick CPU and state save time per schedule for this many schedules instead')
+    parser.add_argument('--max-bytes-per-schedule', type=float, help='Fail if a schedule takes more memory than this')
+    parser.add_argument('--max-tick-us', type=float, help='Fail if ticking a schedule takes more CPU than this')
+    parser.add_argument('--max-save-us', type=float, help='Fail if saving a schedule\'s state takes longer than this')
+    args = parser.parse_args()
+
+    if args.startup:
+        slow = {name: value for name, value in measure_startup(args.startup_runs).items()
+                if args.max_startup_ms is not None and value > args.max_startup_ms}
+        for name, value in slow.items():
+            print(f'FAIL: {name} took {value:.1f}ms to start > {args.max_startup_ms}ms')
+        sys.exit(1 if slow else 0)
+
+    if args.verbose:
+        logs.setup()
+    else:
+        logging.disable(logging.CRITICAL)
+    # Keep benchmark trades out of the real ledger and analytics
+    analytics.use_temporary_files()
+
+    if args.store is not None:
+        results = measure_store(args.store)
+        failures = []
+        if args.max_bytes_per_schedule is not None and results['bytes_per_schedule'] > args.max_bytes_per_schedule:
+            failures.append(f"{results['bytes_per_schedule']:.0f} bytes per schedule > {args.max_bytes_per_schedule}")
+        if args.max_tick_us is not None and results['tick_us_per_schedule'] > args.max_tick_us:
+            failures.append(f"{results['tick_us_per_schedule']:.2f}us to tick a schedule > {args.max_tick_us}us")
+        if args.max_save_us is not None and results['save_us_per_schedule'] > args.max_save_us:
+            failures.append(f"{results['save_us_per_schedule']:.2f}us to save a schedule's state > {args.max_save_us}us")
+        for failure in failures:
+            print(f'FAIL: {failure}')
+        sys.exit(1 if failures else 0)
+
+    results = report(*asyncio.run(run_benchmark(args)))
+    failures = []
+    if args.max_p95_ms is not None and results['p95_ms'] > args.max_p95_ms:
+        failures.append(f"p95 tick latency {results['p95_ms']:.1f}ms > {args.max_p95_ms}ms")
+    if args.max_requests_per_trade is not None and results['requests_per_trade'] > args.max_requests_per_trade:
+        failures.append(f"{results['requests_per_trade']:.2f} requests per trade > {args.max_requests_per_trade}")
+    if args.max_stall_ms is not None and results['stall_max_ms'] > args.max_stall_ms:
+        failures.append(f"event loop stall {results['stall_max_ms']:.1f}ms > {args.max_stall_ms}ms")
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
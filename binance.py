@@ -1,20 +1,25 @@
-import requests
+import asyncio
+import aiohttp
+import calendar
+import contextlib
+import contextvars
+import hashlib
 import json
-import logging, coloredlogs
 
-from datetime import datetime, time, date
+from datetime import datetime, time, date, timedelta
+from decimal import Decimal
 from enum import Enum, unique
 
-import config, utils, telegram
+import config, utils, clock, governor, metrics, market_data, exchange_info, pipeline, logs
+from cache import TTLCache
 from const import *
 
-logger = logging.getLogger(__name__)
-coloredlogs.install(level='DEBUG')
-telegram_handler = telegram.TelegramHandler(config.TELEGRAM_USER_ID)
-telegram_handler.setLevel(logging.INFO)
-logger.addHandler(telegram_handler)
+logger = logs.get_logger(__name__)
 
+# Minimum order value for symbols whose filters haven't been fetched
 MINIMUM_ORDER_VALUE = 10
+# Pair used to price trading fees in BNB
+BNB_FEE_SYMBOL = 'BNBGBP'
 
 
 class Speed():
@@ -32,39 +37,155 @@ headers = {
     'X-MBX-APIKEY': config.API_KEY
 }
 
-
-def get_current_price(symbol=None):
-    params = {}
-    if symbol:
-        params['symbol'] = symbol
-    r = requests.get(BASE_URL + '/api/v3/ticker/price',
-                     params=params,
-                     headers=headers)
-    if r.ok:
-        price = json.loads(r.text)
-        return price
-    else:
-        logger.error(f'Symbol: {symbol}. HTTP {r.status_code}: {r.text}')
+# Seconds before an in-flight request is abandoned
+REQUEST_TIMEOUT = 10
+CONNECT_TIMEOUT = 5
+# Upper bound of pooled keep-alive connections shared by every schedule
+MAX_CONNECTIONS = 50
+
+# How long (seconds) account and price reads are reused across concurrent schedules
+PRICE_TTL = 2
+SPOT_TTL = 5
+EARN_TTL = 5
+
+# Every order's client order id starts with this, so the bot's orders can be picked out of the order history
+CLIENT_ORDER_PREFIX = 'dca-'
+# Hex digits of the schedule's key in its client order ids. Binance allows ids of up to 36 characters.
+SCHEDULE_ID_LENGTH = 6
+# Most recent orders of each symbol checked against the ledger on startup
+RECONCILE_ORDERS = 10
+
+_session = None
+account_cache = TTLCache()
+# Quote currency -> lock held from a batch's balance check until its orders are placed, so concurrent
+# batches never fund their orders from the same balance
+_funding_locks = {}
+symbol_filters = exchange_info.ExchangeInfo(MINIMUM_ORDER_VALUE)
+# FAILURE kind of the last request made by the current task that failed, for transact to decide on a backoff
+last_failure = contextvars.ContextVar('last_failure', default=None)
+
+
+def get_session():
+    # One session for the whole process so connections (and their TLS handshakes) are reused.
+    # Must be called from inside the running event loop.
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS,
+                                         keepalive_timeout=60,
+                                         ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT,
+                                        sock_connect=CONNECT_TIMEOUT)
+        _session = aiohttp.ClientSession(connector=connector,
+                                         timeout=timeout,
+                                         headers=headers)
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    # Locks belong to the loop that used them
+    _funding_locks.clear()
+
+
+def funding_lock(currency):
+    return _funding_locks.setdefault(currency, asyncio.Lock())
+
+
+def error_code(text):
+    try:
+        return json.loads(text).get('code')
+    except (ValueError, AttributeError):
         return None
 
 
-def get_spot_coins(filter=None):
-    params = {'recvWindow': 5000}
-    r = requests.get(BASE_URL + '/sapi/v1/capital/config/getall',
-                     params=utils.sign(params),
-                     headers=headers)
-    if r.ok:
-        wallet = json.loads(r.text)
-        if filter is not None:
-            return utils.filter_coins(wallet, filter)
-        return wallet
-    else:
-        logger.error(f'HTTP {r.status_code}: {r.text}')
-        return None
+async def _request(method, path, params=None, signed=False, error_context='', weight=1):
+    base_params = {} if params is None else params
+    # POSTs aren't retried after a timeout or 5xx, as the order or redemption may already have gone through
+    idempotent = method == 'GET'
+    for attempt in range(governor.MAX_ATTEMPTS):
+        await governor.governor.acquire(path, weight, is_order=path == '/api/v3/order')
+        # Signed again on every attempt so each one carries a fresh timestamp
+        params = dict(base_params)
+        if signed:
+            params = utils.sign(params)
+        # Binance expects signed POST parameters in the body and GET parameters in the query string
+        request_args = {'params': params} if method == 'GET' else {'data': params}
+        status, code, retry_after = None, None, None
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            async with get_session().request(method, BASE_URL + path, **request_args) as r:
+                governor.governor.observe(r.headers)
+                text = await r.text()
+                status = r.status
+                if status < 400:
+                    metrics.REQUEST_LATENCY.observe(loop.time() - started, path, status)
+                    return json.loads(text)
+                code = error_code(text)
+                retry_after = r.headers.get('Retry-After')
+                error = f'{error_context}HTTP {status}: {text}'
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = f'{error_context}Request to {path} failed: {e!r}'
+
+        metrics.REQUEST_LATENCY.observe(loop.time() - started, path, status or 'error')
+        failure = governor.classify(status, code, path)
+        metrics.REQUEST_ERRORS.inc(path, failure.name)
+        last_failure.set(failure)
+        retryable = (failure in (FAILURE.RATE_LIMIT, FAILURE.TIMESTAMP) or
+                     (failure is FAILURE.TRANSIENT and idempotent))
+        if not retryable or attempt == governor.MAX_ATTEMPTS - 1:
+            logger.error(error)
+            return None
+        logger.debug(f'{error}. Retrying ({failure.name})')
+        if failure is FAILURE.RATE_LIMIT:
+            governor.governor.back_off(float(retry_after) if retry_after else governor.backoff_delay(attempt))
+        elif failure is FAILURE.TIMESTAMP:
+            await sample_clock_offset()
+        else:
+            await asyncio.sleep(governor.backoff_delay(attempt))
+
 
+def failure_status():
+    # Quota-type failures (daily redemption limit, insufficient balance) get the long backoff
+    if last_failure.get() is FAILURE.QUOTA:
+        return TRADE.QUOTA_FAILURE
+    if last_failure.get() is FAILURE.UNKNOWN_OUTCOME:
+        return TRADE.UNKNOWN
+    return TRADE.FAILURE
 
-def get_spot_value(coin_symbol):
-    filtered_wallet = get_spot_coins([coin_symbol])
+
+async def get_current_price(symbol=None):
+    # Streamed prices are a memory read. REST is only used when the stream has nothing fresh.
+    if symbol is not None:
+        streamed_price = market_data.feed.get_price(symbol)
+        if streamed_price is not None:
+            return {'symbol': symbol, 'price': str(streamed_price)}
+    params = {}
+    if symbol:
+        params['symbol'] = symbol
+    return await account_cache.get(('price', symbol), PRICE_TTL,
+                                   lambda: _request('GET', '/api/v3/ticker/price',
+                                                    params=params,
+                                                    error_context=f'Symbol: {symbol}. '))
+
+
+async def get_spot_coins(filter=None):
+    # The whole coin list is fetched (and cached) once and filtered locally for each caller
+    wallet = await account_cache.get(('spot',), SPOT_TTL,
+                                     lambda: _request('GET', '/sapi/v1/capital/config/getall',
+                                                      params={'recvWindow': 5000},
+                                                      signed=True,
+                                                      weight=10))
+    if wallet is not None and filter is not None:
+        return utils.filter_coins(wallet, filter)
+    return wallet
+
+
+async def get_spot_value(coin_symbol):
+    filtered_wallet = await get_spot_coins([coin_symbol])
     if filtered_wallet is not None:
         single_wallet = utils.get_single_asset(filtered_wallet, coin_symbol)
         single_spot_value = float(single_wallet['free'])
@@ -73,23 +194,20 @@ def get_spot_value(coin_symbol):
         return None
 
 
-def get_earn_coin(asset_symbol):
+async def get_earn_coin(asset_symbol):
     params = {'recvWindow': 5000,
               'asset': asset_symbol}
-    r = requests.get(BASE_URL + '/sapi/v1/lending/daily/token/position',
-                     params=utils.sign(params),
-                     headers=headers)
-    if r.ok:
-        earn_asset = json.loads(r.text)
-        return earn_asset
-    else:
-        logger.error(f'Symbol: {asset_symbol}. HTTP {r.status_code}: {r.text}')
-        return None
+    return await account_cache.get(('earn', asset_symbol), EARN_TTL,
+                                   lambda: _request('GET', '/sapi/v1/lending/daily/token/position',
+                                                    params=params,
+                                                    signed=True,
+                                                    error_context=f'Symbol: {asset_symbol}. '))
 
 
-def get_earn_value(asset_symbol):
-    earn_details = get_earn_coin(asset_symbol)
-    if earn_details is not None:
+async def get_earn_value(asset_symbol):
+    earn_details = await get_earn_coin(asset_symbol)
+    # An asset with no Flexible Earn position has an empty list
+    if earn_details:
         product_id = earn_details[0]['productId']
         earn_value = float(earn_details[0]['freeAmount'])
         return product_id, earn_value
@@ -97,59 +215,202 @@ def get_earn_value(asset_symbol):
         return None, None
     
 
-def get_srv_time():
-    r = requests.get(BASE_URL + '/api/v3/time')
-    logger.debug(r.text)
+async def get_srv_time():
+    srv_time = await _request('GET', '/api/v3/time')
+    logger.debug(srv_time)
+    return srv_time
 
 
-def place_market_buy(coin_symbol, quot_order_qty):
+async def sample_clock_offset():
+    sent_ms = clock.local_ms()
+    srv_time = await get_srv_time()
+    received_ms = clock.local_ms()
+    if srv_time is None:
+        return None
+    return clock.estimator.add_sample(sent_ms, srv_time['serverTime'], received_ms)
+
+
+async def keep_clock_synced(initial_samples=4):
+    # A few quick samples up front so the very first signed request is already corrected
+    for _ in range(initial_samples):
+        await sample_clock_offset()
+    while True:
+        offset = clock.estimator.offset_ms
+        logger.debug(f'Clock offset from server: {round(offset)}ms '
+                     f'(jitter: {clock.estimator.jitter_ms}ms, rtt: {clock.estimator.rtt_ms}ms)')
+        if abs(offset) > 1000:
+            logger.warning(f'Local clock is {round(offset)}ms away from Binance. Signed requests are being corrected.')
+        await asyncio.sleep(clock.SAMPLE_INTERVAL)
+        await sample_clock_offset()
+
+
+async def refresh_exchange_info():
+    # Only the traded symbols are asked for, the full exchangeInfo response is several megabytes
+    symbols = sorted(symbol_filters.symbols)
+    if not symbols:
+        return None
+    response = await _request('GET', '/api/v3/exchangeInfo',
+                              params={'symbols': json.dumps(symbols, separators=(',', ':'))},
+                              weight=10)
+    if response is not None:
+        symbol_filters.update(response)
+    return response
+
+
+async def keep_exchange_info_fresh():
+    while True:
+        await asyncio.sleep(exchange_info.REFRESH_INTERVAL)
+        await refresh_exchange_info()
+
+
+def client_order_id_for(symbol, tick_time, schedule_key):
+    # The same for every attempt at a tick's order, including one replayed after a restart. The schedule's
+    # key (symbol, amount and interval) is in it too, so schedules on the same pair firing together don't collide.
+    schedule_id = hashlib.sha256(schedule_key.encode('utf-8')).hexdigest()[:SCHEDULE_ID_LENGTH]
+    return f'{CLIENT_ORDER_PREFIX}{symbol}-{calendar.timegm(tick_time.timetuple())}-{schedule_id}'
+
+
+async def place_market_buy(coin_symbol, quot_order_qty, client_order_id):
     params = {'recvWindow': 5000,
               'symbol': coin_symbol,
               'side': 'BUY',
               'type': 'MARKET',
-              'quoteOrderQty': quot_order_qty
+              'quoteOrderQty': quot_order_qty,
+              'newClientOrderId': client_order_id
               }
-    r = requests.post(BASE_URL + '/api/v3/order',
-                      data=utils.sign(params),
-                      headers=headers)
-    if r.ok:
-        buy_res = json.loads(r.text)
-        return buy_res
-    else:
-        logger.error(f'Error buying {coin_symbol}. HTTP {r.status_code}: Message: {r.text}')
+    for attempt in range(governor.MAX_ATTEMPTS):
+        buy_res = await _request('POST', '/api/v3/order',
+                                 params=params,
+                                 signed=True,
+                                 error_context=f'Error buying {coin_symbol}. ')
+        if buy_res is not None or last_failure.get() is not FAILURE.TRANSIENT:
+            break
+        # The response was lost (timeout or 5xx) so the order may have gone through. Only if the order
+        # history says it didn't is it safe to send again.
+        await asyncio.sleep(governor.backoff_delay(attempt))
+        buy_res = await find_order(coin_symbol, client_order_id)
+        if buy_res is not False:
+            if buy_res is None:
+                logger.critical(f"Couldn't check whether {coin_symbol} order {client_order_id} went through. "
+                                f"It will be looked up again before the schedule sends another.")
+                last_failure.set(FAILURE.UNKNOWN_OUTCOME)
+            break
+        logger.debug(f'{coin_symbol} order {client_order_id} was not placed. Retrying.')
+    # Balances have moved (or may have, if the response was lost), so don't serve them from cache
+    account_cache.invalidate(('spot',))
+    return buy_res or None
+
+
+async def get_recent_orders(symbol, limit=RECONCILE_ORDERS):
+    return await _request('GET', '/api/v3/allOrders',
+                          params={'recvWindow': 5000, 'symbol': symbol, 'limit': limit},
+                          signed=True,
+                          error_context=f'Error getting {symbol} orders. ',
+                          weight=20)
+
+
+async def get_order_trades(symbol, order_id):
+    return await _request('GET', '/api/v3/myTrades',
+                          params={'recvWindow': 5000, 'symbol': symbol, 'orderId': order_id},
+                          signed=True,
+                          error_context=f'Error getting {symbol} order {order_id} trades. ',
+                          weight=20)
+
+
+def is_own_fill(order):
+    return order['clientOrderId'].startswith(CLIENT_ORDER_PREFIX) and Decimal(order['executedQty']) > 0
+
+
+async def order_response(order):
+    # Rebuilds the response the order request would have got from the order and its trades, so it's
+    # recorded exactly like any other fill. None if the trades couldn't be fetched.
+    trades = await get_order_trades(order['symbol'], order['orderId'])
+    if trades is None:
         return None
-
-def redeem_flexible_product(product_id, amount, speed):
+    response = {key: order[key] for key in ('symbol', 'orderId', 'clientOrderId', 'price', 'origQty', 'executedQty',
+                                            'cummulativeQuoteQty', 'status', 'timeInForce', 'type', 'side')}
+    response['transactTime'] = order['updateTime']
+    response['fills'] = [{'price': trade['price'],
+                          'qty': trade['qty'],
+                          'commission': trade['commission'],
+                          'commissionAsset': trade['commissionAsset'],
+                          'tradeId': trade['id']}
+                         for trade in trades]
+    return response
+
+
+async def find_order(symbol, client_order_id):
+    # The response for the order sent with `client_order_id` if it was filled, False if it wasn't and
+    # None if that couldn't be found out
+    orders = await get_recent_orders(symbol)
+    if orders is None:
+        return None
+    for order in orders:
+        if order['clientOrderId'] == client_order_id:
+            return await order_response(order) if is_own_fill(order) else False
+    return False
+
+
+async def reconcile_symbol(symbol):
+    orders = await get_recent_orders(symbol)
+    if orders is None:
+        logger.error(f"Couldn't check {symbol} order history against the trade ledger. "
+                     f"An order sent just before the last stop may be placed again.")
+        return 0
+    # The ledger is in time order, so anything it's missing was sent after the last trade it has
+    last_trade = utils.get_last_trade_datetime(symbol)
+    recovered = 0
+    for order in sorted(orders, key=lambda order: order['time']):
+        if not is_own_fill(order) or datetime.utcfromtimestamp(order['time'] / 1000) <= last_trade:
+            continue
+        response = await order_response(order)
+        if response is None:
+            logger.error(f"Couldn't recover {symbol} order {order['clientOrderId']} missing from the trade ledger")
+            break
+        logger.warning(f"Recovering {symbol} order {order['clientOrderId']} missing from the trade ledger")
+        utils.parse_market_buy(response)
+        recovered += 1
+    return recovered
+
+
+async def reconcile_orders(symbols):
+    # Fills the ledger missed, because the process stopped between an order going through and its fill
+    # being written, are recovered from the order history so the restarted schedules don't buy again.
+    # Returns how many were recovered.
+    return sum(await asyncio.gather(*(reconcile_symbol(symbol) for symbol in symbols)))
+
+
+async def redeem_flexible_product(product_id, amount, speed):
     params = {'productId': product_id,
               'amount': amount,
               'type': speed
               }
-    r = requests.post(BASE_URL + '/sapi/v1/lending/daily/redeem',
-                      data=utils.sign(params),
-                      headers=headers)
-
-    if r.ok:
-        redeem_res = json.loads(r.text)
-        return redeem_res
-    else:
-        logger.error(f'Product ID: {product_id}. HTTP {r.status_code}: {r.text}')
-        return None
+    redeem_res = await _request('POST', '/sapi/v1/lending/daily/redeem',
+                                params=params,
+                                signed=True,
+                                error_context=f'Product ID: {product_id}. ')
+    # Only the product ID is known here, so drop every cached earn position along with spot
+    account_cache.invalidate(('spot',))
+    account_cache.invalidate_kind('earn')
+    return redeem_res
     
 
-def estimate_bnb_fee(trade_amount):
-    current_price = get_current_price('BNBGBP')
+async def estimate_bnb_fee(trade_amount):
+    current_price = await get_current_price(BNB_FEE_SYMBOL)
     if current_price is not None:
-        fee_in_fiat = trade_amount * config.TRADING_FEE
+        fee_in_fiat = float(trade_amount) * config.TRADING_FEE
         fee_in_bnb = fee_in_fiat / float(current_price['price'])
         return fee_in_bnb
     else:
         return None
 
 
-def check_and_move_bnb_for_fees(fee_est):
+async def check_and_move_bnb_for_fees(fee_est, bnb_spot_available):
+    # `bnb_spot_available` is the current BNB Spot holdings, looked up alongside the fee estimate
+    if fee_est is None:
+        logger.error(f'Attempted to estimate the BNB fee but failed. Will attempt trade anyway.')
+        return
     safe_fee_buffer = fee_est * 5
-    # Check current BNB Spot holdings
-    bnb_spot_available = get_spot_value('BNB')
     if bnb_spot_available is None:
         logger.error(f'Attempted to get BNB spot value but failed. Will attempt trade anyway.')
         return
@@ -157,7 +418,7 @@ def check_and_move_bnb_for_fees(fee_est):
     # If there's not enough balance in Spot, then attempt a withdraw
     if bnb_spot_available < safe_fee_buffer:
         # Get current BNB Vault holdings
-        bnb_earn_product_id, bnb_earn_available = get_earn_value('BNB')
+        bnb_earn_product_id, bnb_earn_available = await get_earn_value('BNB')
         if bnb_earn_product_id is None or bnb_earn_available is None:
             logger.error(f'Attempted to get BNB earn value (and ID) but failed. Will attempt trade anyway.')
             return
@@ -177,14 +438,14 @@ def check_and_move_bnb_for_fees(fee_est):
         withdraw_amount = max(safe_fee_buffer, 0.001)
         # Withdraw whichever is larger: safe_fee_buffer or the minimum of 0.001 BNB
         if bnb_earn_available >= withdraw_amount:
-            if redeem_flexible_product(bnb_earn_product_id,
+            if await redeem_flexible_product(bnb_earn_product_id,
                                        withdraw_amount,
                                        Speed.FAST) is None:
                 logger.error(f'Failed to redeem BNB for fees. Will attempt trade anyway.')
                 return
         # If there isn't enough to withdraw the full amount, attempt to withdraw all earn holdings
         elif bnb_earn_available < withdraw_amount and bnb_earn_available != 0:
-            if redeem_flexible_product(bnb_earn_product_id,
+            if await redeem_flexible_product(bnb_earn_product_id,
                                        bnb_earn_available,
                                        Speed.FAST) is None:
                 logger.error('Failed to redeem BNB for fees. Will attempt trade anyway.')
@@ -198,49 +459,148 @@ def savings_lock_check():
     time_to_unlock = None
     lock_start = time(23, 48, 0)
     lock_end = time(0, 10, 0)
-    time_now = datetime.utcnow().time()
+    time_now = clock.utcnow().time()
     is_locked = utils.time_in_range(lock_start, lock_end, time_now)
     if is_locked:
         if utils.time_in_range(lock_start, time(23, 59, 59), time_now):
             time_to_unlock = (datetime.combine(date.min, time(23, 59, 59)) - 
                               datetime.combine(date.min, time_now) + 
-                              datetime.timedelta(minutes=10, seconds=30))
+                              timedelta(minutes=10, seconds=30))
         else:
             time_to_unlock = (datetime.combine(date.min, time(0, 10, 30)) - 
                               datetime.combine(date.min, time_now))
     return is_locked, time_to_unlock
         
 
-def transact(wallet, side, quote_order_quantity):
+async def fund_quote_currency(quote_currency, orders, current_quote_holdings):
+    # Make sure spot, currently holding `current_quote_holdings`, has enough quote currency for every order in
+    # `orders` (wallet, quantity) with at most one redemption. Returns the orders that could be funded and
+    # the TRADE status for the rest.
+    symbols = ', '.join(wallet.symbol for wallet, _ in orders)
+    total_quantity = sum(quantity for _, quantity in orders)
+    if current_quote_holdings is None:
+        logger.critical(f'Failed to get current spot value for quote currency. {symbols} trade failed.')
+        return [], TRADE.FAILURE
+    current_quote_holdings = Decimal(str(current_quote_holdings))
+    if current_quote_holdings >= total_quantity:
+        return orders, None
+
+    earn_product_id, earn_available = await get_earn_value(quote_currency)
+    if earn_product_id is None or earn_available is None:
+        logger.critical(f'Failed to get earn value for {quote_currency}. {symbols} trade failed.')
+        return [], TRADE.FAILURE
+    earn_available = Decimal(str(earn_available))
+    if earn_available <= 30:
+        logger.warning(f"Only {earn_available} left in Earn wallet. Top up today so trades don't fail tomorrow.")
+    # Fund orders in turn until the combined spot and earn balance runs out
+    funded_orders = []
+    funded_quantity = 0
+    for wallet, quantity in orders:
+        if funded_quantity + quantity > earn_available + current_quote_holdings:
+            logger.critical(f'Insufficient {quote_currency} to make trade. '
+                            f'Availble: {earn_available}. {wallet.symbol} trade failed.')
+            continue
+        funded_orders.append((wallet, quantity))
+        funded_quantity += quantity
+    if funded_quantity > current_quote_holdings:
+        did_redeem = await redeem_flexible_product(earn_product_id, funded_quantity - current_quote_holdings, Speed.FAST)
+        if did_redeem is None:
+            symbols = ', '.join(wallet.symbol for wallet, _ in funded_orders)
+            logger.critical(f'Failed to redeem quote currency for trade. {symbols} trade failed.')
+            return [], failure_status()
+    # Anything left unfunded ran out of balance
+    return funded_orders, TRADE.QUOTA_FAILURE
+
+
+async def execute_market_buy(wallet, quote_order_quantity, client_order_id=None):
+    if client_order_id is None:
+        client_order_id = client_order_id_for(wallet.symbol, clock.utcnow(), wallet.symbol)
+    response = await place_market_buy(wallet.symbol, quote_order_quantity, client_order_id)
+    if response is not None:
+        utils.parse_market_buy(response)
+        return TRADE.SUCCESS
+    else:
+        logger.critical(f'Failed to execute {wallet.symbol} trade.')
+        return failure_status()
+
+
+def size_orders(orders):
+    # Round each order to its symbol's precision and drop any its filters would reject, so no request is
+    # wasted on them. Those stay NO_TRADE_YET and keep their buffer.
+    sized_orders = []
+    for wallet, quantity in orders:
+        price = market_data.feed.get_price(wallet.symbol)
+        sized_quantity, reason = symbol_filters.size_quote_order(wallet.symbol, quantity, price)
+        if sized_quantity is None:
+            logger.warning(f'Not placing {wallet.symbol} order: {reason}')
+            continue
+        sized_orders.append((wallet, sized_quantity))
+    return sized_orders
+
+
+async def transact_batch(orders, client_order_ids=None):
+    # Buy every (wallet, quote_order_quantity) in `orders` sharing one BNB top-up sized for all their fees
+    # and one redemption per quote currency. Returns a TRADE status per order.
+    # `client_order_ids` maps id(wallet) to the id its order is sent with, by default one made from the current time.
+    statuses = {id(wallet): TRADE.NO_TRADE_YET for wallet, _ in orders}
+    sized_orders = size_orders(orders)
+    if sized_orders:
+        await transact_sized(sized_orders, statuses, client_order_ids or {})
+    for wallet, _ in orders:
+        metrics.TRADES.inc(wallet.symbol, statuses[id(wallet)].name)
+    return [statuses[id(wallet)] for wallet, _ in orders]
+
+
+async def transact_sized(orders, statuses, client_order_ids):
+    orders_by_quote = {}
+    for wallet, quantity in orders:
+        orders_by_quote.setdefault(wallet.quote_currency, []).append((wallet, quantity))
+    # Batches fired concurrently take turns per quote currency (always locked in the same order, so two
+    # batches can't each wait on the other), and each reads the balance the one before it left
+    async with contextlib.AsyncExitStack() as locks:
+        for quote_currency in sorted(orders_by_quote):
+            await locks.enter_async_context(funding_lock(quote_currency))
+        await transact_funded(orders, orders_by_quote, statuses, client_order_ids)
+
+
+async def transact_funded(orders, orders_by_quote, statuses, client_order_ids):
+    # Steps run as soon as what they need is ready: the fee estimate and every balance read together,
+    # the BNB top-up alongside each quote currency's funding, and each order once both are done.
+    steps = pipeline.StepGraph(symbols=[wallet.symbol for wallet, _ in orders])
+    steps.add('bnb_price', 'estimate_bnb_fee', lambda: estimate_bnb_fee(sum(quantity for _, quantity in orders)))
+    steps.add('bnb_spot', 'spot_balance', lambda: get_spot_value('BNB'))
+    steps.add('bnb_top_up', 'bnb_top_up', check_and_move_bnb_for_fees, 'bnb_price', 'bnb_spot')
+
+    async def funded_wallets(funding):
+        # ids of the funded orders' wallets, so each order checks its own in constant time
+        funded_orders, unfunded_status = await funding
+        return {id(wallet) for wallet, _ in funded_orders}, unfunded_status
+
+    for quote_currency, quote_orders in orders_by_quote.items():
+        # Both spot reads share one cached account request
+        steps.add(f'{quote_currency}_spot', 'spot_balance', lambda quote_currency=quote_currency: get_spot_value(quote_currency))
+        steps.add(f'{quote_currency}_funding', 'fund_quote',
+                  lambda holdings, quote_currency=quote_currency, quote_orders=quote_orders:
+                  funded_wallets(fund_quote_currency(quote_currency, quote_orders, holdings)),
+                  f'{quote_currency}_spot')
+
+    async def place_order(wallet, quantity, bnb_top_up, funding):
+        funded_ids, unfunded_status = funding
+        if id(wallet) not in funded_ids:
+            return unfunded_status
+        return await execute_market_buy(wallet, quantity, client_order_ids.get(id(wallet)))
+
+    for n, (wallet, quantity) in enumerate(orders):
+        steps.add(f'{wallet.symbol}_order_{n}', 'place_order',
+                  lambda bnb_top_up, funding, wallet=wallet, quantity=quantity:
+                  place_order(wallet, quantity, bnb_top_up, funding),
+                  'bnb_top_up', f'{wallet.quote_currency}_funding')
+    results = await steps.run()
+    for n, (wallet, _) in enumerate(orders):
+        statuses[id(wallet)] = results[f'{wallet.symbol}_order_{n}']
+
+
+async def transact(wallet, side, quote_order_quantity):
     if side is Side.BUY:
-        fee_est = estimate_bnb_fee(quote_order_quantity)
-        check_and_move_bnb_for_fees(fee_est)
-
-        current_quote_holdings = get_spot_value(wallet.quote_currency)
-        if current_quote_holdings is None:
-            logger.critical(f'Failed to get current spot value for quote currency. {wallet.symbol} trade failed.')
-            return TRADE.FAILURE
-
-        if current_quote_holdings < quote_order_quantity:
-            earn_product_id, earn_available = get_earn_value(wallet.quote_currency)
-            if earn_product_id is None or earn_available is None:
-                logger.critical(f'Failed to get earn value for {wallet.quote_currency}. {wallet.symbol} trade failed.')
-                return TRADE.FAILURE
-            if earn_available <= 30:
-                logger.warning(f"Only {earn_available} left in Earn wallet. Top up today so trades don't fail tomorrow.")
-            if (earn_available + current_quote_holdings) < quote_order_quantity:
-                logger.critical(f'Insufficient {wallet.quote_currency} to make trade. '
-                                 f'Availble: {earn_available}. {wallet.symbol} trade failed.')
-                return TRADE.FAILURE
-            did_redeem = redeem_flexible_product(earn_product_id, quote_order_quantity - current_quote_holdings, Speed.FAST)
-            if did_redeem is None:
-                logger.critical(f'Failed to redeem quote currency for trade. {wallet.symbol} trade failed.')
-                return TRADE.FAILURE
-        
-        response = place_market_buy(wallet.symbol, quote_order_quantity)
-        if response is not None:
-            utils.parse_market_buy(response)
-            return TRADE.SUCCESS
-        else:
-            logger.critical(f'Failed to execute {wallet.symbol} trade.')
-            return TRADE.FAILURE
+        statuses = await transact_batch([(wallet, quote_order_quantity)])
+        return statuses[0]
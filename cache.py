@@ -0,0 +1,50 @@
+import asyncio
+
+
+class TTLCache:
+    """Short-lived cache for awaitable fetches.
+
+    Keys are tuples whose first element names the kind of entry (e.g. ('earn', 'BNB')) so a whole
+    kind can be invalidated at once. Concurrent callers for the same key share one in-flight fetch.
+    Failed fetches (None) are never cached.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.in_flight = {}
+
+    async def get(self, key, ttl, fetch):
+        loop = asyncio.get_running_loop()
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > loop.time():
+            return entry[1]
+        task = self.in_flight.get(key)
+        if task is None:
+            task = loop.create_task(fetch())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda t: self._store(key, ttl, t))
+        # Shielded so one caller being cancelled doesn't cancel the fetch for everyone else
+        return await asyncio.shield(task)
+
+    def _store(self, key, ttl, task):
+        # If the key was invalidated while the fetch was running, the result may already be stale
+        if self.in_flight.get(key) is not task:
+            return
+        del self.in_flight[key]
+        if task.cancelled() or task.exception() is not None or task.result() is None:
+            return
+        self.entries[key] = (asyncio.get_running_loop().time() + ttl, task.result())
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+        self.in_flight.pop(key, None)
+
+    def invalidate_kind(self, kind):
+        for key in [k for k in self.entries if k[0] == kind]:
+            del self.entries[key]
+        for key in [k for k in self.in_flight if k[0] == kind]:
+            del self.in_flight[key]
+
+    def clear(self):
+        self.entries.clear()
+        self.in_flight.clear()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""Command line entry point: run the bot, show schedule status, send a notification or report on trades.
+
+Each command only imports what it needs, so the ones that don't trade (in particular the
+notifications systemd runs after a crash or reboot) start quickly.
+"""
+import argparse
+import glob
+import os
+import sys
+
+from datetime import datetime
+
+import config, logs, analytics
+
+CRASH_MESSAGE = '💥 The {service} service has crashed!'
+REBOOT_MESSAGE = '🔌 The system has rebooted. DCA is not running!'
+
+
+def run(args):
+    logs.setup()
+    if getattr(config, 'ACCOUNTS', None):
+        import supervisor
+        supervisor.main()
+    else:
+        import asyncio, main
+        asyncio.run(main.main())
+
+
+def state_files():
+    import state
+    paths = [state.STATE_FILE] if os.path.exists(state.STATE_FILE) else []
+    if getattr(config, 'ACCOUNTS', None):
+        # Laid out by the supervisor as <data dir>/<account>/<shard>/
+        import supervisor
+        paths += sorted(glob.glob(os.path.join(supervisor.DATA_DIR, '*', '*', state.STATE_FILE)))
+    return paths
+
+
+def status(args):
+    import state
+    paths = args.state or state_files()
+    if not paths:
+        print('No saved schedule state found. Has the bot run yet?')
+        return 1
+    now = datetime.utcnow()
+    for path in paths:
+        snapshot = state.load(path)
+        if snapshot is None:
+            print(f'{path}: no snapshot')
+            continue
+        saved_at = datetime.fromisoformat(snapshot['saved_at'])
+        print(f'{path} (saved {saved_at:%Y-%m-%d %H:%M:%S} UTC, {round((now - saved_at).total_seconds())}s ago)')
+        print(f"{'schedule':>28} {'buffer':>10} {'next tick (UTC)':>20} {'last status':>14}")
+        for key, schedule in sorted(snapshot['schedules'].items()):
+            next_tick = datetime.fromisoformat(schedule['next_tick'])
+            paused = '  paused' if schedule['paused'] else ''
+            print(f"{key:>28} {float(schedule['buffer']):>10.4f} {next_tick:%Y-%m-%d %H:%M:%S} "
+                  f"{schedule['last_status']:>14}{paused}")
+    return 0
+
+
+def notify(args):
+    import telegram
+    if args.crash is not None:
+        message = CRASH_MESSAGE.format(service=args.crash)
+    elif args.reboot:
+        message = REBOOT_MESSAGE
+    else:
+        message = ' '.join(args.message)
+    sender = telegram.get_sender(config.TELEGRAM_USER_ID)
+    sender.send(message)
+    return 0 if sender.flush() else 1
+
+
+def report(args):
+    logs.setup()
+    analytics.report(args)
+
+
+def parser():
+    parser = argparse.ArgumentParser(description='Dollar cost average into crypto on Binance.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('run', help='Run every schedule (all accounts if ACCOUNTS is set)').set_defaults(handler=run)
+
+    status_parser = commands.add_parser('status', help='Show each schedule from the last saved state')
+    status_parser.add_argument('--state', nargs='+', help='State snapshot files (default: all that exist)')
+    status_parser.set_defaults(handler=status)
+
+    notify_parser = commands.add_parser('notify', help='Send a Telegram message')
+    notify_parser.add_argument('message', nargs='*')
+    notify_parser.add_argument('--crash', metavar='SERVICE', help='Say SERVICE has crashed')
+    notify_parser.add_argument('--reboot', action='store_true', help='Say the system has rebooted')
+    notify_parser.set_defaults(handler=notify)
+
+    report_parser = commands.add_parser('report', help='Report cost basis and fees from the trade ledger')
+    analytics.add_report_arguments(report_parser)
+    report_parser.set_defaults(handler=report)
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    if args.command == 'notify' and not (args.message or args.crash is not None or args.reboot):
+        sys.exit('Nothing to send')
+    sys.exit(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()
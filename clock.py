@@ -0,0 +1,58 @@
+import time
+import statistics
+
+from datetime import datetime
+
+from collections import deque
+
+# Number of recent server time samples the offset is estimated from
+SAMPLES_KEPT = 8
+# Seconds between server time samples once synced
+SAMPLE_INTERVAL = 300
+
+
+class ClockOffsetEstimator:
+    """Estimates the offset between the local clock and the exchange's from round-trip timed samples.
+
+    Each sample assumes the server read its clock half way through the round trip. Samples with the
+    shortest round trips have the least uncertainty, so the offset is the median of the faster half.
+    """
+
+    def __init__(self, samples_kept=SAMPLES_KEPT):
+        self.samples = deque(maxlen=samples_kept)
+        self.offset_ms = 0.0
+        self.jitter_ms = None
+        self.rtt_ms = None
+
+    def add_sample(self, sent_ms, server_ms, received_ms):
+        rtt = received_ms - sent_ms
+        self.samples.append((rtt, server_ms - (sent_ms + received_ms) / 2))
+        best = sorted(self.samples)[:max(len(self.samples) // 2, 1)]
+        self.offset_ms = statistics.median(offset for _, offset in best)
+        self.rtt_ms = statistics.median(rtt for rtt, _ in best)
+        if len(self.samples) > 1:
+            self.jitter_ms = statistics.pstdev(offset for _, offset in self.samples)
+        return self.offset_ms
+
+    def now_ms(self):
+        return round(local_ms() + self.offset_ms)
+
+
+# Seconds since the epoch. The simulator replaces it with a virtual clock so schedules run faster than real time.
+source = time.time
+
+
+def local_ms():
+    return source() * 1000
+
+
+def utcnow():
+    return datetime.utcfromtimestamp(source())
+
+
+estimator = ClockOffsetEstimator()
+
+
+def now_ms():
+    # Local time corrected to the exchange's clock, in milliseconds
+    return estimator.now_ms()
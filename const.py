@@ -4,6 +4,12 @@ from enum import Enum, unique
 class BinanceCode(Enum):
     INSUFFICIENT_BALANCE = -2010
     AMOUNT_TOO_SMALL = -1013
+    UNKNOWN = -1000
+    DISCONNECTED = -1001
+    TOO_MANY_REQUESTS = -1003
+    TIMEOUT = -1007
+    TOO_MANY_ORDERS = -1015
+    INVALID_TIMESTAMP = -1021
 
 @unique
 class Error(Enum):
@@ -18,4 +24,16 @@ class Side(Enum):
 class TRADE(Enum):
     SUCCESS = 0
     FAILURE = 1
-    NO_TRADE_YET = 2
\ No newline at end of file
+    NO_TRADE_YET = 2
+    QUOTA_FAILURE = 3
+    # The order was sent but whether it went through couldn't be found out
+    UNKNOWN = 4
+
+@unique
+class FAILURE(Enum):
+    TRANSIENT = 0
+    RATE_LIMIT = 1
+    TIMESTAMP = 2
+    QUOTA = 3
+    FATAL = 4
+    UNKNOWN_OUTCOME = 5
\ No newline at end of file
@@ -23,5 +23,14 @@ class InsufficientBalanceError(Error):
                        f'Available: {self.available}')
 
     def __str__(self):
-        telegram.send_message(config.TELEGRAM_USER_ID, f"🚨 {self.message}")
-        return f'{self.message}'
\ No newline at end of file
+        telegram.get_sender(config.TELEGRAM_USER_ID).send(f"🚨 {self.message}")
+        return f'{self.message}'
+
+class InvalidScheduleError(Error):
+    def __init__(self, path, message):
+        self.path = path
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f'{self.path} -> {self.message}'
@@ -0,0 +1,70 @@
+from collections import namedtuple
+from decimal import Decimal, ROUND_DOWN
+
+# Seconds between background refreshes. Binance rarely changes filters, but it does happen.
+REFRESH_INTERVAL = 60 * 60
+# Used for symbols whose filters haven't been fetched (yet)
+DEFAULT_QUOTE_PRECISION = 8
+
+SymbolFilters = namedtuple('SymbolFilters', 'min_notional quote_precision min_qty max_qty')
+
+
+def parse_filters(symbol_info):
+    filters = {f['filterType']: f for f in symbol_info['filters']}
+    # Older responses have MIN_NOTIONAL, newer ones NOTIONAL. Both carry minNotional.
+    notional = filters.get('MIN_NOTIONAL') or filters.get('NOTIONAL') or {}
+    # Market orders are bound by MARKET_LOT_SIZE where it's set, otherwise LOT_SIZE
+    lot_size = filters.get('LOT_SIZE', {})
+    market_lot_size = filters.get('MARKET_LOT_SIZE', {})
+    if Decimal(market_lot_size.get('maxQty', 0)) > 0:
+        lot_size = market_lot_size
+    return SymbolFilters(min_notional=Decimal(notional.get('minNotional', 0)),
+                         quote_precision=int(symbol_info.get('quoteAssetPrecision',
+                                                             symbol_info.get('quotePrecision', DEFAULT_QUOTE_PRECISION))),
+                         min_qty=Decimal(lot_size.get('minQty', 0)),
+                         max_qty=Decimal(lot_size.get('maxQty', 0)))
+
+
+class ExchangeInfo:
+    """Index of each traded symbol's order filters, so orders are sized to pass them before they're sent."""
+
+    def __init__(self, default_min_notional):
+        self.default_min_notional = Decimal(default_min_notional)
+        self.symbols = set()
+        self.filters = {}
+        # Bumped on every update, so anything caching filters knows to re-read them
+        self.version = 0
+
+    def track(self, symbols):
+        # Returns whether any of `symbols` weren't tracked before, i.e. the index needs a refresh
+        new_symbols = set(symbols) - self.symbols
+        self.symbols |= new_symbols
+        return bool(new_symbols)
+
+    def update(self, response):
+        for symbol_info in response['symbols']:
+            self.filters[symbol_info['symbol']] = parse_filters(symbol_info)
+        self.version += 1
+
+    def minimum_order_value(self, symbol):
+        filters = self.filters.get(symbol)
+        if filters is None or not filters.min_notional:
+            return self.default_min_notional
+        return filters.min_notional
+
+    def size_quote_order(self, symbol, quote_quantity, price=None):
+        # Returns (quote quantity rounded down to what the symbol accepts, None) or (None, why it can't be ordered).
+        # Base quantity limits are only checked when a price is known.
+        filters = self.filters.get(symbol)
+        precision = DEFAULT_QUOTE_PRECISION if filters is None else filters.quote_precision
+        quote_quantity = Decimal(quote_quantity).quantize(Decimal(1).scaleb(-precision), rounding=ROUND_DOWN)
+        minimum = self.minimum_order_value(symbol)
+        if quote_quantity < minimum:
+            return None, f'{quote_quantity} is below the {symbol} minimum order value of {minimum}'
+        if filters is not None and price:
+            base_quantity = quote_quantity / Decimal(str(price))
+            if base_quantity < filters.min_qty:
+                return None, f'{base_quantity:.8f} is below the {symbol} minimum quantity of {filters.min_qty}'
+            if filters.max_qty and base_quantity > filters.max_qty:
+                return None, f'{base_quantity:.8f} is above the {symbol} maximum quantity of {filters.max_qty}'
+        return quote_quantity, None
@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+"""Local stand-in for the Binance endpoints and market data stream used by the bot.
+
+Balances, prices and orders are held in memory. Latency, random errors and request-weight rate
+limiting can be configured so the hot path can be exercised and measured without the real API.
+Signatures are not checked.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+
+from collections import deque
+from aiohttp import web
+
+# Request weights, roughly as documented by Binance
+WEIGHTS = {
+    '/api/v3/ticker/price': 1,
+    '/sapi/v1/capital/config/getall': 10,
+    '/sapi/v1/lending/daily/token/position': 1,
+    '/sapi/v1/lending/daily/redeem': 1,
+    '/api/v3/order': 1,
+    '/api/v3/time': 1,
+    '/api/v3/exchangeInfo': 10,
+    '/api/v3/allOrders': 20,
+    '/api/v3/myTrades': 20,
+}
+SIGNED_PATHS = {
+    '/sapi/v1/capital/config/getall',
+    '/sapi/v1/lending/daily/token/position',
+    '/sapi/v1/lending/daily/redeem',
+    '/api/v3/order',
+    '/api/v3/allOrders',
+    '/api/v3/myTrades',
+}
+QUOTE_CURRENCIES = ('GBP', 'USDT', 'BUSD', 'EUR', 'BTC', 'ETH', 'BNB')
+DEFAULT_MIN_NOTIONAL = 10
+QUOTE_PRECISION = 8
+
+
+def error_response(status, code, msg):
+    return web.json_response({'code': code, 'msg': msg}, status=status)
+
+
+class FakeExchange:
+    def __init__(self, latency=0, latency_jitter=0, error_rate=0, weight_limit=1200,
+                 spot=None, earn=None, prices=None, default_price=1, clock_offset_ms=0, stream_interval=0.5,
+                 min_notional=None, clock=time.time, lost_response_rate=0, normal_redemption_delay=0,
+                 fast_redemption_limit=None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        # Fraction of POSTs that take effect but are answered with a timeout, as if the response was lost
+        self.lost_response_rate = lost_response_rate
+        # Seconds before a NORMAL redemption reaches spot. FAST ones arrive straight away.
+        self.normal_redemption_delay = normal_redemption_delay
+        # FAST redemptions allowed per asset per (UTC) day, unlimited if None
+        self.fast_redemption_limit = fast_redemption_limit
+        self.fast_redemptions = {}
+        # Request weight allowed per rolling minute before answering 429
+        self.weight_limit = weight_limit
+        # How far the exchange clock is ahead of the local one, to exercise clock sync
+        self.clock_offset_ms = clock_offset_ms
+        # Seconds since the epoch, swappable for a virtual clock
+        self.clock = clock
+        self.spot = dict(spot or {'BNB': 10, 'GBP': 10000, 'USDT': 10000})
+        self.earn = dict(earn or {'BNB': 100, 'GBP': 100000, 'USDT': 100000})
+        self.prices = dict(prices or {'BNBGBP': 300, 'BNBUSDT': 400})
+        self.default_price = default_price
+        # symbol -> MIN_NOTIONAL filter, DEFAULT_MIN_NOTIONAL for anything not listed
+        self.min_notional = dict(min_notional or {})
+        self.request_counts = {}
+        # (time, weight) of the requests in the rolling minute, and their total
+        self.weight_log = deque()
+        self.weight_in_window = 0
+        self.orders = []
+        self.redemptions = []
+        self.order_ids = itertools.count(1)
+        self.app = web.Application(middlewares=[self.middleware])
+        self.app.router.add_get('/api/v3/ticker/price', self.ticker_price)
+        self.app.router.add_get('/api/v3/time', self.server_time)
+        self.app.router.add_get('/api/v3/exchangeInfo', self.exchange_info)
+        self.app.router.add_get('/sapi/v1/capital/config/getall', self.capital_config)
+        self.app.router.add_get('/sapi/v1/lending/daily/token/position', self.lending_position)
+        self.app.router.add_post('/sapi/v1/lending/daily/redeem', self.lending_redeem)
+        self.app.router.add_post('/api/v3/order', self.order)
+        self.app.router.add_get('/api/v3/allOrders', self.all_orders)
+        self.app.router.add_get('/api/v3/myTrades', self.my_trades)
+        self.app.router.add_get('/stream', self.stream)
+        self.runner = None
+        # Seconds between pushes to market data stream subscribers
+        self.stream_interval = stream_interval
+        self.streams = set()
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        return f'http://{host}:{port}'
+
+    async def stop(self):
+        await self.disconnect_streams()
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    def used_weight(self):
+        # Event loop time, so the rolling minute also passes at the rate a virtual time loop runs at
+        minute_ago = asyncio.get_running_loop().time() - 60
+        while self.weight_log and self.weight_log[0][0] <= minute_ago:
+            self.weight_in_window -= self.weight_log.popleft()[1]
+        return self.weight_in_window
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        self.request_counts[request.path] = self.request_counts.get(request.path, 0) + 1
+        if self.latency or self.latency_jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.latency_jitter))
+        self.weight_log.append((asyncio.get_running_loop().time(), WEIGHTS.get(request.path, 1)))
+        self.weight_in_window += self.weight_log[-1][1]
+        used_weight = self.used_weight()
+        weight_header = 'X-SAPI-USED-IP-WEIGHT-1M' if request.path.startswith('/sapi/') else 'X-MBX-USED-WEIGHT-1M'
+        headers = {weight_header: str(used_weight)}
+        if used_weight > self.weight_limit:
+            response = error_response(429, -1003, 'Too many requests; current limit is '
+                                                  f'{self.weight_limit} request weight per 1 MINUTE.')
+            response.headers['Retry-After'] = '60'
+        elif random.random() < self.error_rate:
+            response = error_response(503, -1001, 'Internal error; unable to process your request. Please try again.')
+        else:
+            params = dict(request.query)
+            if request.method == 'POST':
+                params.update(await request.post())
+            if request.path in SIGNED_PATHS and ('timestamp' not in params or 'signature' not in params):
+                response = error_response(400, -1102, "Mandatory parameter 'signature' was not sent.")
+            else:
+                request['params'] = params
+                response = await handler(request)
+                if request.method == 'POST' and random.random() < self.lost_response_rate:
+                    response = error_response(504, -1007, 'Timeout waiting for response from backend server. '
+                                                          'Send status unknown; execution status unknown.')
+        response.headers.update(headers)
+        return response
+
+    def now_ms(self):
+        return round(self.clock() * 1000 + self.clock_offset_ms)
+
+    def price(self, symbol):
+        return self.prices.get(symbol, self.default_price)
+
+    async def ticker_price(self, request):
+        symbol = request['params'].get('symbol')
+        if symbol is None:
+            return web.json_response([{'symbol': s, 'price': str(p)} for s, p in self.prices.items()])
+        return web.json_response({'symbol': symbol, 'price': str(self.price(symbol))})
+
+    async def server_time(self, request):
+        return web.json_response({'serverTime': self.now_ms()})
+
+    async def capital_config(self, request):
+        return web.json_response([{'coin': coin, 'free': str(free), 'locked': '0'}
+                                  for coin, free in self.spot.items()])
+
+    async def lending_position(self, request):
+        asset = request['params']['asset']
+        # Like Binance, an asset with no Flexible Earn position has no entry
+        if asset not in self.earn:
+            return web.json_response([])
+        return web.json_response([{'asset': asset,
+                                   'productId': f'{asset}001',
+                                   'freeAmount': str(self.earn.get(asset, 0))}])
+
+    async def lending_redeem(self, request):
+        params = request['params']
+        asset = params['productId'][:-3]
+        amount = float(params['amount'])
+        if amount > self.earn.get(asset, 0):
+            return error_response(400, -6004, 'Insufficient redeemable amount.')
+        if params['type'] == 'FAST' and self.fast_redemption_limit is not None:
+            day = (asset, self.now_ms() // (24 * 60 * 60 * 1000))
+            if self.fast_redemptions.get(day, 0) >= self.fast_redemption_limit:
+                return error_response(400, -6011, 'Exceeded the daily fast redemption limit.')
+            self.fast_redemptions[day] = self.fast_redemptions.get(day, 0) + 1
+        self.earn[asset] -= amount
+        if params['type'] == 'NORMAL' and self.normal_redemption_delay:
+            asyncio.get_running_loop().call_later(self.normal_redemption_delay, self.credit_spot, asset, amount)
+        else:
+            self.credit_spot(asset, amount)
+        self.redemptions.append({'asset': asset, 'amount': amount, 'type': params['type'], 'time': self.now_ms()})
+        return web.json_response({})
+
+    def credit_spot(self, asset, amount):
+        self.spot[asset] = self.spot.get(asset, 0) + amount
+
+    async def exchange_info(self, request):
+        symbols = json.loads(request.query.get('symbols', '[]'))
+        if any(self.split_symbol(symbol)[0] is None for symbol in symbols):
+            return error_response(400, -1121, 'Invalid symbol.')
+        return web.json_response({'timezone': 'UTC',
+                                  'serverTime': self.now_ms(),
+                                  'symbols': [self.symbol_info(symbol) for symbol in symbols]})
+
+    def symbol_info(self, symbol):
+        base, quote = self.split_symbol(symbol)
+        return {'symbol': symbol,
+                'status': 'TRADING',
+                'baseAsset': base,
+                'baseAssetPrecision': 8,
+                'quoteAsset': quote,
+                'quotePrecision': QUOTE_PRECISION,
+                'quoteAssetPrecision': QUOTE_PRECISION,
+                'filters': [{'filterType': 'LOT_SIZE', 'minQty': '0.00000100', 'maxQty': '9000000.00000000',
+                             'stepSize': '0.00000100'},
+                            {'filterType': 'MIN_NOTIONAL',
+                             'minNotional': f'{self.min_notional.get(symbol, DEFAULT_MIN_NOTIONAL):.8f}',
+                             'applyToMarket': True, 'avgPriceMins': 5},
+                            {'filterType': 'MARKET_LOT_SIZE', 'minQty': '0.00000000', 'maxQty': '0.00000000',
+                             'stepSize': '0.00000000'}]}
+
+    def split_symbol(self, symbol):
+        for quote in QUOTE_CURRENCIES:
+            if symbol.endswith(quote) and symbol != quote:
+                return symbol[:-len(quote)], quote
+        return None, None
+
+    async def disconnect_streams(self):
+        # Drop every market data stream, as Binance does every 24 hours
+        for ws in list(self.streams):
+            await ws.close()
+
+    async def stream(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.streams.add(ws)
+        subscribed = set()
+
+        async def push_prices():
+            while True:
+                for symbol in subscribed:
+                    await ws.send_json({'stream': f'{symbol.lower()}@miniTicker',
+                                        'data': {'e': '24hrMiniTicker',
+                                                 'E': self.now_ms(),
+                                                 's': symbol,
+                                                 'c': f'{self.price(symbol):.8f}'}})
+                await asyncio.sleep(self.stream_interval)
+
+        pusher = asyncio.ensure_future(push_prices())
+        try:
+            async for message in ws:
+                if message.type != web.WSMsgType.TEXT:
+                    continue
+                subscription = json.loads(message.data)
+                if subscription.get('method') == 'SUBSCRIBE':
+                    subscribed.update(stream.split('@')[0].upper() for stream in subscription['params'])
+                    await ws.send_json({'result': None, 'id': subscription['id']})
+        finally:
+            pusher.cancel()
+            self.streams.discard(ws)
+        return ws
+
+    async def order(self, request):
+        params = request['params']
+        symbol = params['symbol']
+        base, quote = self.split_symbol(symbol)
+        if base is None:
+            return error_response(400, -1121, 'Invalid symbol.')
+        if len(params['quoteOrderQty'].partition('.')[2]) > QUOTE_PRECISION:
+            return error_response(400, -1111, 'Precision is over the maximum defined for this asset.')
+        quote_qty = float(params['quoteOrderQty'])
+        if quote_qty < self.min_notional.get(symbol, DEFAULT_MIN_NOTIONAL):
+            return error_response(400, -1013, 'Filter failure: MIN_NOTIONAL')
+        if quote_qty > self.spot.get(quote, 0):
+            return error_response(400, -2010, 'Account has insufficient balance for requested action.')
+        price = self.price(symbol)
+        qty = quote_qty / price
+        commission = quote_qty * 0.00075 / self.price(f'BNB{quote}')
+        self.spot[quote] -= quote_qty
+        self.spot[base] = self.spot.get(base, 0) + qty
+        self.spot['BNB'] = self.spot.get('BNB', 0) - commission
+        order = {'symbol': symbol,
+                 'orderId': next(self.order_ids),
+                 'clientOrderId': params.get('newClientOrderId', f'fake{time.time_ns()}'),
+                 'transactTime': self.now_ms(),
+                 'price': '0.00000000',
+                 'origQty': f'{qty:.8f}',
+                 'executedQty': f'{qty:.8f}',
+                 'cummulativeQuoteQty': f'{quote_qty:.8f}',
+                 'status': 'FILLED',
+                 'timeInForce': 'GTC',
+                 'type': 'MARKET',
+                 'side': 'BUY',
+                 'fills': [{'price': f'{price:.8f}',
+                            'qty': f'{qty:.8f}',
+                            'commission': f'{commission:.8f}',
+                            'commissionAsset': 'BNB',
+                            'tradeId': next(self.order_ids)}]}
+        self.orders.append(order)
+        return web.json_response(order)
+
+    async def all_orders(self, request):
+        params = request['params']
+        orders = [order for order in self.orders if order['symbol'] == params['symbol']]
+        limit = int(params.get('limit', 500))
+        return web.json_response([self.order_info(order) for order in orders[-limit:]])
+
+    def order_info(self, order):
+        # An order as the order history lists it: no fills, and creation and update times instead of transactTime
+        info = {key: value for key, value in order.items() if key not in ('fills', 'transactTime')}
+        info.update(time=order['transactTime'],
+                    updateTime=order['transactTime'],
+                    origQuoteOrderQty=order['cummulativeQuoteQty'])
+        return info
+
+    async def my_trades(self, request):
+        params = request['params']
+        trades = []
+        for order in self.orders:
+            if order['symbol'] != params['symbol'] or str(order['orderId']) != params.get('orderId', str(order['orderId'])):
+                continue
+            for fill in order['fills']:
+                trades.append({'symbol': order['symbol'],
+                               'id': fill['tradeId'],
+                               'orderId': order['orderId'],
+                               'price': fill['price'],
+                               'qty': fill['qty'],
+                               'quoteQty': f"{float(fill['price']) * float(fill['qty']):.8f}",
+                               'commission': fill['commission'],
+                               'commissionAsset': fill['commissionAsset'],
+                               'time': order['transactTime'],
+                               'isBuyer': True,
+                               'isMaker': False,
+                               'isBestMatch': True})
+        return web.json_response(trades)
+
+
+async def serve(args):
+    exchange = FakeExchange(latency=args.latency,
+                            latency_jitter=args.jitter,
+                            error_rate=args.error_rate,
+                            weight_limit=args.weight_limit,
+                            lost_response_rate=args.lost_response_rate,
+                            normal_redemption_delay=args.normal_delay,
+                            fast_redemption_limit=args.fast_limit)
+    url = await exchange.start(args.host, args.port)
+    print(f'Fake exchange listening on {url}')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await exchange.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the Binance API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0, help='Random extra latency, up to this many seconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of requests answered with a 503')
+    parser.add_argument('--lost-response-rate', type=float, default=0,
+                        help='Fraction of POSTs that go through but are answered with a timeout')
+    parser.add_argument('--normal-delay', type=float, default=0,
+                        help='Seconds before a NORMAL redemption reaches spot')
+    parser.add_argument('--fast-limit', type=int, help='FAST redemptions allowed per asset per day')
+    parser.add_argument('--weight-limit', type=int, default=1200, help='Request weight allowed per minute')
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import asyncio
+import random
+
+from const import *
+
+# Binance's default limits. The bucket only spends this fraction of them to leave headroom.
+API_WEIGHT_PER_MINUTE = 1200
+SAPI_WEIGHT_PER_MINUTE = 12000
+ORDERS_PER_10_SECONDS = 50
+SAFETY_FACTOR = 0.8
+
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30
+
+TRANSIENT_CODES = {BinanceCode.UNKNOWN.value,
+                   BinanceCode.DISCONNECTED.value,
+                   BinanceCode.TIMEOUT.value}
+RATE_LIMIT_CODES = {BinanceCode.TOO_MANY_REQUESTS.value,
+                    BinanceCode.TOO_MANY_ORDERS.value}
+
+
+class TokenBucket:
+    def __init__(self, capacity, period, used_weight_header=None, share=1):
+        # `share` is the fraction of the limit this process may use when others spend from the same limit
+        self.share = share
+        self.capacity = capacity * SAFETY_FACTOR * share
+        self.refill_rate = self.capacity / period
+        self.tokens = self.capacity
+        # Header Binance reports the weight used in this bucket's window with
+        self.used_weight_header = used_weight_header
+        self.updated = None
+
+    def _refill(self, now):
+        if self.updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    def wait_time(self, weight, now):
+        # Seconds until `weight` tokens are available
+        self._refill(now)
+        return max(weight - self.tokens, 0) / self.refill_rate
+
+    def take(self, weight):
+        self.tokens -= weight
+
+    def observe(self, used_weight, now):
+        # The server's count covers every client on this IP/account, so trust it when it's higher
+        self._refill(now)
+        self.tokens = min(self.tokens, self.capacity - used_weight * self.share)
+
+
+class RequestGovernor:
+    """Paces requests from every schedule against Binance's request weight and order rate limits.
+
+    Request weight is limited per IP and order rate per account, so processes sharing either are
+    given a share of it.
+    """
+
+    def __init__(self, ip_share=1, account_share=1, api_weight_per_minute=API_WEIGHT_PER_MINUTE,
+                 sapi_weight_per_minute=SAPI_WEIGHT_PER_MINUTE, orders_per_10_seconds=ORDERS_PER_10_SECONDS):
+        # The limits default to Binance's. A server without an order rate limit has orders_per_10_seconds of None.
+        self.buckets = {'api': TokenBucket(api_weight_per_minute, 60, 'X-MBX-USED-WEIGHT-1M', ip_share),
+                        'sapi': TokenBucket(sapi_weight_per_minute, 60, 'X-SAPI-USED-IP-WEIGHT-1M', ip_share)}
+        if orders_per_10_seconds is not None:
+            self.buckets['orders'] = TokenBucket(orders_per_10_seconds, 10, 'X-MBX-ORDER-COUNT-10S', account_share)
+        self.blocked_until = 0
+
+    def _costs(self, path, weight, is_order):
+        costs = [(self.buckets['sapi' if path.startswith('/sapi/') else 'api'], weight)]
+        if is_order and 'orders' in self.buckets:
+            costs.append((self.buckets['orders'], 1))
+        return costs
+
+    async def acquire(self, path, weight=1, is_order=False):
+        loop = asyncio.get_running_loop()
+        costs = self._costs(path, weight, is_order)
+        while True:
+            now = loop.time()
+            delay = max([self.blocked_until - now] +
+                        [bucket.wait_time(cost, now) for bucket, cost in costs])
+            if delay <= 0:
+                for bucket, cost in costs:
+                    bucket.take(cost)
+                return
+            await asyncio.sleep(delay)
+
+    def observe(self, response_headers):
+        now = asyncio.get_running_loop().time()
+        for bucket in self.buckets.values():
+            used_weight = response_headers.get(bucket.used_weight_header)
+            if used_weight is not None:
+                bucket.observe(int(used_weight), now)
+
+    def back_off(self, seconds):
+        # Stop every request until the server says it's safe again, rather than collecting a 418 IP ban
+        self.blocked_until = max(self.blocked_until, asyncio.get_running_loop().time() + seconds)
+
+
+def classify(status, code, path):
+    if status in (429, 418) or code in RATE_LIMIT_CODES:
+        return FAILURE.RATE_LIMIT
+    if code == BinanceCode.INVALID_TIMESTAMP.value:
+        return FAILURE.TIMESTAMP
+    if status is None or status >= 500 or code in TRANSIENT_CODES:
+        return FAILURE.TRANSIENT
+    if code == BinanceCode.INSUFFICIENT_BALANCE.value or path == '/sapi/v1/lending/daily/redeem':
+        # Redemptions mostly fail on the daily FAST redemption quota
+        return FAILURE.QUOTA
+    return FAILURE.FATAL
+
+
+def backoff_delay(attempt):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+governor = RequestGovernor()
@@ -0,0 +1,138 @@
+import os
+import json
+
+from datetime import datetime
+
+import logs
+
+logger = logs.get_logger(__name__)
+
+LEDGER_FILE = 'trades.jsonl'
+INDEX_FILE = 'trades.index.json'
+# Appends between index rewrites. The index is only a shortcut, so at most this many trades are replayed on open.
+INDEX_INTERVAL = 100
+# Pre-ledger trade history. Migrated into the ledger the first time it is opened.
+LEGACY_FILE = 'trades.json'
+
+
+class Ledger:
+    """Append-only JSON-lines trade ledger with a per-symbol index of the latest transactTime.
+
+    The index records the ledger byte offset it covers; anything appended past it is replayed on open.
+    """
+
+    def __init__(self, path=LEDGER_FILE, index_path=INDEX_FILE, legacy_path=LEGACY_FILE):
+        self.path = path
+        self.index_path = index_path
+        self.legacy_path = legacy_path
+        # symbol -> latest transactTime in milliseconds
+        self.last_trade = {}
+        self.offset = 0
+        # Trades appended since the index was last written
+        self.unindexed = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            if os.path.exists(self.legacy_path):
+                self.migrate(self.legacy_path)
+            else:
+                open(self.path, 'a').close()
+        index = self._read_index()
+        if index is not None and index['offset'] <= os.path.getsize(self.path):
+            self.last_trade = index['last_trade']
+            self.offset = index['offset']
+        else:
+            self.last_trade = {}
+            self.offset = 0
+        if self._replay() > 0:
+            self._write_index()
+
+    def _read_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_index(self):
+        # Written to a temporary file and swapped in so a crash never leaves a half written index.
+        # No fsync needed: a stale index is caught up from the ledger on the next open.
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            # dumps uses the C encoder where dump doesn't, and this is on the trade path every INDEX_INTERVAL appends
+            f.write(json.dumps({'offset': self.offset, 'last_trade': self.last_trade}))
+        os.replace(tmp_path, self.index_path)
+        self.unindexed = 0
+
+    def _replay(self):
+        replayed = 0
+        with open(self.path, 'rb+') as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # A crash mid-append leaves an unterminated line. It was never acknowledged so drop it.
+                    logger.warning(f'Dropping partially written entry at the end of {self.path}')
+                    f.truncate(self.offset)
+                    break
+                self._index_trade(json.loads(line))
+                self.offset += len(line)
+                replayed += 1
+        return replayed
+
+    def _index_trade(self, trade):
+        symbol = trade.get('symbol')
+        transact_time = trade.get('transactTime')
+        if symbol is None or transact_time is None:
+            return
+        if transact_time > self.last_trade.get(symbol, 0):
+            self.last_trade[symbol] = transact_time
+
+    def append(self, trade):
+        line = (json.dumps(trade) + '\n').encode('utf-8')
+        with open(self.path, 'ab') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.offset += len(line)
+        self._index_trade(trade)
+        self.unindexed += 1
+        if self.unindexed >= INDEX_INTERVAL:
+            self._write_index()
+
+    def last_trade_datetime(self, symbol):
+        transact_time = self.last_trade.get(symbol)
+        if transact_time is None:
+            return datetime.min
+        # UTC, like the times it's compared with
+        return datetime.utcfromtimestamp(transact_time / 1000)
+
+    def trades(self):
+        with open(self.path) as f:
+            for line in f:
+                if line.endswith('\n'):
+                    yield json.loads(line)
+
+    def migrate(self, legacy_path):
+        with open(legacy_path) as f:
+            legacy_trades = json.load(f)['trades']
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for trade in legacy_trades:
+                f.write(json.dumps(trade) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        # Keep the original around rather than deleting trade history
+        os.replace(legacy_path, legacy_path + '.migrated')
+        logger.info(f'Migrated {len(legacy_trades)} trades from {legacy_path} to {self.path}')
+
+
+_ledger = None
+
+
+def get_ledger():
+    global _ledger
+    if _ledger is None:
+        _ledger = Ledger()
+    return _ledger
@@ -0,0 +1,131 @@
+import asyncio
+
+from datetime import timedelta
+from decimal import Decimal, ROUND_UP
+
+import binance, clock, utils, logs
+from binance import Speed
+
+logger = logs.get_logger(__name__)
+
+# Seconds between checks of every currency's spot float
+PLAN_INTERVAL = 60 * 60
+# How long a NORMAL redemption can take to reach spot. Until then the float has to last on its own.
+NORMAL_REDEMPTION_DELAY = timedelta(days=1)
+# A float is topped back up to a full horizon's spend once it's down to this fraction of one
+REFILL_AT = Decimal('0.5')
+# BNB for fees is forecast at the current price, with room for it to fall
+FEE_HEADROOM = 2
+# Smallest amount Binance will redeem
+MINIMUM_REDEMPTION = {'BNB': Decimal('0.001')}
+REDEMPTION_PLACES = Decimal('1e-8')
+
+
+def forecast_spend(schedules, time_now, horizon):
+    # Quote currency -> what the running schedules will spend in the ticks due over `horizon`. A schedule whose
+    # buffer won't reach its minimum order value in that time spends nothing, otherwise all of it.
+    spend = {}
+    horizon_end = time_now + horizon
+    for schedule in schedules:
+        quote_currency = schedule.wallet.quote_currency
+        spend.setdefault(quote_currency, Decimal(0))
+        if not schedule.active or schedule.paused or schedule.next_tick > horizon_end:
+            continue
+        ticks = (horizon_end - schedule.next_tick) // schedule.timedelta_interval + 1
+        buffer = schedule.wallet.buffered_dca_quote_value + Decimal(str(schedule.tick_amount)) * ticks
+        if buffer >= binance.symbol_filters.minimum_order_value(schedule.wallet.symbol):
+            spend[quote_currency] += buffer
+    return spend
+
+
+class LiquidityPlanner:
+    """Keeps enough of each quote currency, and of BNB for fees, in spot for the schedules' spend over a horizon.
+
+    Floats are topped up in a few pooled redemptions, at NORMAL speed whenever what's left will last until
+    it arrives, so trades rarely need a FAST redemption of their own and the daily FAST quota is left alone.
+    """
+
+    def __init__(self, scheduler, horizon):
+        self.scheduler = scheduler
+        self.horizon = horizon
+        # currency -> [(amount, when it will have arrived)] for NORMAL redemptions still on their way
+        self.pending = {}
+
+    def pending_amount(self, currency, time_now):
+        self.pending[currency] = [(amount, arrival) for amount, arrival in self.pending.get(currency, [])
+                                  if arrival > time_now]
+        return sum(amount for amount, _ in self.pending[currency])
+
+    async def targets(self, time_now):
+        # currency -> (spend over the horizon, spend before a NORMAL redemption would arrive)
+        schedules = list(self.scheduler.schedules.values())
+        horizon_spend = forecast_spend(schedules, time_now, self.horizon)
+        normal_spend = forecast_spend(schedules, time_now, NORMAL_REDEMPTION_DELAY)
+        targets = {currency: (horizon_spend[currency], normal_spend[currency]) for currency in horizon_spend}
+        horizon_fee = await binance.estimate_bnb_fee(sum(horizon_spend.values()))
+        normal_fee = await binance.estimate_bnb_fee(sum(normal_spend.values()))
+        if horizon_fee is None or normal_fee is None:
+            logger.error('Failed to forecast BNB fees. Trades will top up BNB as they need it.')
+            return targets
+        target, until_normal = targets.get('BNB', (Decimal(0), Decimal(0)))
+        targets['BNB'] = (target + Decimal(str(horizon_fee)) * FEE_HEADROOM,
+                          until_normal + Decimal(str(normal_fee)) * FEE_HEADROOM)
+        return targets
+
+    async def top_up(self, currency, target, until_normal, time_now):
+        spot = await binance.get_spot_value(currency)
+        product_id, earn = await binance.get_earn_value(currency)
+        if spot is None:
+            logger.error(f'Failed to get {currency} balances to plan redemptions. Trades will redeem what they need.')
+            return
+        if product_id is None or earn is None:
+            # Either nothing is held in Flexible Earn or it couldn't be read (which _request has logged)
+            logger.debug(f'No {currency} Flexible Earn position to plan redemptions from')
+            return
+        spot, earn = Decimal(str(spot)), Decimal(str(earn))
+        available = spot + self.pending_amount(currency, time_now)
+        if available >= target * REFILL_AT:
+            return
+        amount = max(target - available, MINIMUM_REDEMPTION.get(currency, 0)).quantize(REDEMPTION_PLACES, ROUND_UP)
+        amount = min(amount, earn)
+        if amount < MINIMUM_REDEMPTION.get(currency, REDEMPTION_PLACES):
+            logger.warning(f'Not enough {currency} in Earn to cover the next {self.horizon} of trades. Top up soon!')
+            return
+        # FAST only when spot would run dry before a NORMAL redemption arrived
+        speed = Speed.NORMAL if spot >= until_normal else Speed.FAST
+        if await binance.redeem_flexible_product(product_id, amount, speed) is None:
+            logger.error(f'Failed to redeem {amount} {currency} ({speed}). Trades will redeem what they need.')
+            return
+        logger.info(f'Redeemed {amount} {currency} ({speed}) for the next {self.horizon} of trades')
+        if speed == Speed.NORMAL:
+            self.pending.setdefault(currency, []).append((amount, time_now + NORMAL_REDEMPTION_DELAY))
+
+    async def plan(self):
+        time_now = clock.utcnow()
+        targets = await self.targets(time_now)
+        results = await asyncio.gather(*(self.top_up(currency, target, until_normal, time_now)
+                                         for currency, (target, until_normal) in targets.items()),
+                                       return_exceptions=True)
+        # One currency failing to plan mustn't stop the others, or the bot. Its trades redeem what they need.
+        for currency, result in zip(targets, results):
+            if isinstance(result, Exception):
+                logger.error(f'Failed to plan {currency} redemptions. Trades will redeem what they need.',
+                             exc_info=result)
+
+    async def run(self):
+        while True:
+            # Nothing can be redeemed in the savings lock window
+            is_locked, _ = binance.savings_lock_check()
+            if not is_locked:
+                try:
+                    await self.plan()
+                except Exception:
+                    logger.exception('Redemption planning failed. Trades will redeem what they need.')
+            await asyncio.sleep(PLAN_INTERVAL)
+
+
+async def keep_funded(scheduler, horizon):
+    # Without a horizon (an interval string) there's no planning and every trade redeems exactly what it needs
+    if horizon is None:
+        return
+    await LiquidityPlanner(scheduler, utils.parse_timedelta_string(horizon)).run()
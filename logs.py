@@ -0,0 +1,45 @@
+import logging
+
+# Records at or above this level from the bot's own loggers are sent to Telegram
+ALERT_LEVEL = logging.INFO
+
+_configured = False
+
+
+class AlertHandler(logging.Handler):
+    """Sends records to Telegram once logging is set up, only importing the Telegram client when there's something to send."""
+
+    def __init__(self):
+        super().__init__(ALERT_LEVEL)
+        self.enabled = False
+        self.handler = None
+
+    def emit(self, record):
+        if not self.enabled:
+            return
+        if self.handler is None:
+            import telegram, config
+            self.handler = telegram.TelegramHandler(config.TELEGRAM_USER_ID)
+        self.handler.emit(record)
+
+
+alert_handler = AlertHandler()
+
+
+def get_logger(name):
+    # Cheap enough to call at import time: nothing is configured until an entry point calls setup()
+    logger = logging.getLogger(name)
+    if alert_handler not in logger.handlers:
+        logger.addHandler(alert_handler)
+    return logger
+
+
+def setup(level='DEBUG', alerts=True):
+    # Console logging and Telegram alerts, configured once by whichever entry point runs
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    import coloredlogs
+    coloredlogs.install(level=level)
+    alert_handler.enabled = alerts
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import aiohttp
+
+import logs
+
+logger = logs.get_logger(__name__)
+
+STREAM_URL = 'wss://stream.binance.com:9443/stream'
+# Prices older than this (seconds) aren't trusted and callers fall back to REST
+STALE_AFTER = 10
+RECONNECT_BACKOFF_CAP = 60
+# Consecutive failed connection attempts before it's worth an alert
+RECONNECT_ALERT_THRESHOLD = 5
+
+
+class MarketData:
+    """Latest prices for a set of symbols, kept up to date over one multiplexed websocket.
+
+    Binance drops stream connections every 24 hours (and sometimes sooner), so the connection is
+    re-established and every symbol resubscribed whenever it closes.
+    """
+
+    def __init__(self, url=STREAM_URL):
+        self.url = url
+        self.symbols = set()
+        # symbol -> (price, event loop time it was received)
+        self.prices = {}
+        self.ws = None
+        self.request_ids = 0
+
+    def get_price(self, symbol):
+        entry = self.prices.get(symbol)
+        if entry is None:
+            return None
+        price, received = entry
+        if asyncio.get_running_loop().time() - received > STALE_AFTER:
+            return None
+        return price
+
+    async def subscribe(self, symbols):
+        new_symbols = set(symbols) - self.symbols
+        self.symbols |= new_symbols
+        if new_symbols and self.ws is not None and not self.ws.closed:
+            await self._send_subscribe(new_symbols)
+
+    async def _send_subscribe(self, symbols):
+        self.request_ids += 1
+        await self.ws.send_json({'method': 'SUBSCRIBE',
+                                 'params': [f'{symbol.lower()}@miniTicker' for symbol in sorted(symbols)],
+                                 'id': self.request_ids})
+
+    def _handle(self, message):
+        data = json.loads(message).get('data')
+        # Subscription acknowledgements have no data
+        if data is None or data.get('e') != '24hrMiniTicker':
+            return
+        self.prices[data['s']] = (float(data['c']), asyncio.get_running_loop().time())
+
+    async def run(self):
+        failures = 0
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    async with session.ws_connect(self.url, heartbeat=30) as ws:
+                        self.ws = ws
+                        failures = 0
+                        if self.symbols:
+                            await self._send_subscribe(self.symbols)
+                        logger.debug(f'Market data stream connected for {len(self.symbols)} symbols')
+                        async for message in ws:
+                            if message.type == aiohttp.WSMsgType.TEXT:
+                                self._handle(message.data)
+                            elif message.type == aiohttp.WSMsgType.ERROR:
+                                break
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    failures += 1
+                    logger.debug(f'Market data stream connection failed: {e!r}')
+                    if failures == RECONNECT_ALERT_THRESHOLD:
+                        logger.warning(f'Market data stream has failed to connect {failures} times. '
+                                       f'Prices are coming from REST until it recovers.')
+                finally:
+                    self.ws = None
+                await asyncio.sleep(min(2 ** failures, RECONNECT_BACKOFF_CAP) if failures else 1)
+
+
+feed = MarketData()
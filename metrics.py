@@ -0,0 +1,150 @@
+import asyncio
+import bisect
+import json
+import time
+
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DRIFT_BUCKETS = (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+LOOP_LAG_INTERVAL = 0.1
+
+
+def format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self, extra_labels=()):
+        for label_values, value in self.values.items():
+            yield self.name + format_labels(self.labels, label_values, extra_labels), value
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value, *label_values):
+        self.values[label_values] = value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts (last is +Inf), sum, count]
+        self.values = {}
+
+    def observe(self, value, *label_values):
+        entry = self.values.get(label_values)
+        if entry is None:
+            entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self, extra_labels=()):
+        extra_labels = list(extra_labels)
+        for label_values, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(list(self.buckets) + ['+Inf'], counts):
+                cumulative += bucket_count
+                yield (self.name + '_bucket' + format_labels(self.labels, label_values, extra_labels + [('le', bound)]),
+                       cumulative)
+            yield self.name + '_sum' + format_labels(self.labels, label_values, extra_labels), total
+            yield self.name + '_count' + format_labels(self.labels, label_values, extra_labels), count
+
+
+REQUEST_LATENCY = Histogram('dca_request_seconds', 'Binance request latency', ('endpoint', 'status'))
+REQUEST_ERRORS = Counter('dca_request_errors_total', 'Failed Binance requests', ('endpoint', 'failure'))
+PHASE_LATENCY = Histogram('dca_phase_seconds', 'Time spent in each phase of a trade', ('phase',))
+TICK_DRIFT = Histogram('dca_tick_drift_seconds', 'How late ticks fired compared to when they were due',
+                       buckets=DRIFT_BUCKETS)
+LOOP_LAG = Histogram('dca_event_loop_lag_seconds', 'Event loop scheduling lag')
+TRADES = Counter('dca_trades_total', 'Trade outcomes', ('symbol', 'status'))
+CRITICAL_PATH = Histogram('dca_critical_path_seconds', 'Time each trade step spent on the critical path of its batch',
+                          ('phase',))
+registry = [REQUEST_LATENCY, REQUEST_ERRORS, PHASE_LATENCY, TICK_DRIFT, LOOP_LAG, TRADES, CRITICAL_PATH]
+
+_trace_file = None
+
+
+def open_trace(path):
+    # Spans are appended as Chrome trace 'complete' events, one JSON object per line
+    global _trace_file
+    _trace_file = open(path, 'a', buffering=1)
+
+
+@contextmanager
+def span(phase, **args):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        PHASE_LATENCY.observe(duration, phase)
+        if _trace_file is not None:
+            _trace_file.write(json.dumps({'name': phase, 'ph': 'X', 'pid': 0, 'tid': 0,
+                                          'ts': round((time.time() - duration) * 1e6),
+                                          'dur': round(duration * 1e6),
+                                          'args': args}) + '\n')
+
+
+def collect(extra_labels=()):
+    # Plain data (picklable) version of the registry, e.g. to send to the supervisor
+    return [(metric.name, metric.help, metric.type, list(metric.samples(extra_labels))) for metric in registry]
+
+
+def render(families=None):
+    lines = []
+    for name, help, type, samples in (collect() if families is None else families):
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {type}')
+        lines.extend(f'{sample} {value}' for sample, value in samples)
+    return '\n'.join(lines) + '\n'
+
+
+async def monitor_event_loop(interval=LOOP_LAG_INTERVAL):
+    # Anything this oversleeps by is time the loop was busy with something that didn't yield
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(loop.time() - started - interval, 0))
+
+
+async def serve(host='127.0.0.1', port=9108, render=render, health=None):
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=render(), content_type='text/plain')
+
+    async def handle_health(request):
+        return web.json_response(health())
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    if health is not None:
+        app.router.add_get('/health', handle_health)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
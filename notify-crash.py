@@ -1,9 +1,9 @@
 #!/usr/bin/env python
 import sys
-import telegram, config
+import cli
 
 service_name = '<unknown>'
 if len(sys.argv) >= 2:
   service_name = sys.argv[1]
 
-telegram.send_message(config.TELEGRAM_USER_ID, f"💥 The {service_name} service has crashed!")
+cli.main(['notify', '--crash', service_name])
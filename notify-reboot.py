@@ -1,4 +1,4 @@
 #!/usr/bin/env python
-import telegram, config
+import cli
 
-telegram.send_message(config.TELEGRAM_USER_ID, f"🔌 The system has rebooted. DCA is not running!")
\ No newline at end of file
+cli.main(['notify', '--reboot'])
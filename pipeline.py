@@ -0,0 +1,61 @@
+import asyncio
+
+import metrics, logs
+
+logger = logs.get_logger(__name__)
+
+
+class StepGraph:
+    """Runs each named step as soon as the steps it depends on have finished, so independent steps overlap.
+
+    Every step is timed, and the chain of steps that held up the last one to finish (the critical
+    path) is reported once they've all run.
+    """
+
+    def __init__(self, **span_args):
+        self.span_args = span_args
+        self.tasks = {}
+        self.dependencies = {}
+        # name -> (phase, started, finished) in event loop time. Started is when its dependencies were done.
+        self.times = {}
+
+    def add(self, name, phase, step, *dependencies):
+        # `step` is called with the results of `dependencies` (names of steps added before it) and returns an awaitable
+        self.dependencies[name] = dependencies
+        self.tasks[name] = asyncio.ensure_future(self._run(name, phase, step, dependencies))
+        return name
+
+    async def _run(self, name, phase, step, dependencies):
+        results = [await self.tasks[dependency] for dependency in dependencies]
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            with metrics.span(phase, step=name, **self.span_args):
+                return await step(*results)
+        finally:
+            self.times[name] = (phase, started, loop.time())
+
+    async def run(self):
+        # Every step is let finish (an order may be in flight) before the first failure, if any, is raised
+        results = await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        self.report()
+        return dict(zip(self.tasks, results))
+
+    def critical_path(self):
+        path = []
+        name = max(self.times, key=lambda step: self.times[step][2], default=None)
+        while name is not None:
+            path.append(name)
+            name = max(self.dependencies[name], key=lambda step: self.times[step][2], default=None)
+        return path[::-1]
+
+    def report(self):
+        path = self.critical_path()
+        for name in path:
+            phase, started, finished = self.times[name]
+            metrics.CRITICAL_PATH.observe(finished - started, phase)
+        logger.debug('Critical path: ' + ' -> '.join(f'{name} {round((self.times[name][2] - self.times[name][1]) * 1000)}ms'
+                                                      for name in path))
@@ -0,0 +1,108 @@
+import os
+import asyncio
+import toml
+
+import utils, binance, clock, market_data, logs
+from scheduler import Schedule, retune
+from exceptions import InvalidIntervalStringError, InvalidScheduleError
+
+logger = logs.get_logger(__name__)
+
+SCHEDULES_FILE = 'schedules.toml'
+# Seconds between checks of the schedules file for changes
+RELOAD_INTERVAL = 5
+FIELDS = ('base', 'quote', 'amount', 'interval')
+
+
+def load(path=SCHEDULES_FILE):
+    # Returns (base, quote, amount, interval) tuples, the same as dca()'s arguments. Raises InvalidScheduleError.
+    try:
+        parsed = toml.load(path)
+    except (OSError, ValueError, IndexError) as e:
+        raise InvalidScheduleError(path, f'Unreadable schedules file: {e!r}')
+    # The parser is lenient, so anything unexpected is treated as a mistake rather than as no schedules
+    entries = parsed.get('schedule', [])
+    if set(parsed) - {'schedule'} or not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+        raise InvalidScheduleError(path, 'Expected only [[schedule]] tables')
+    schedules = []
+    symbols = set()
+    for n, entry in enumerate(entries, 1):
+        unknown = set(entry) - set(FIELDS)
+        missing = set(FIELDS) - set(entry)
+        if unknown or missing:
+            raise InvalidScheduleError(path, f'Schedule {n} has unknown fields {sorted(unknown)} '
+                                             f'or is missing {sorted(missing)}')
+        base, quote, amount, interval = (entry[field] for field in FIELDS)
+        if not (isinstance(base, str) and base.isalnum() and isinstance(quote, str) and quote.isalnum()):
+            raise InvalidScheduleError(path, f'Schedule {n} needs base and quote currency codes, e.g. "BTC" and "GBP"')
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount <= 0:
+            raise InvalidScheduleError(path, f'Schedule {n} amount must be a positive number')
+        try:
+            utils.parse_timedelta_string(interval)
+        except InvalidIntervalStringError as e:
+            raise InvalidScheduleError(path, f'Schedule {n}: {e}')
+        base, quote = base.upper(), quote.upper()
+        # Schedules are matched up between reloads (and trades in the ledger) by symbol
+        if base + quote in symbols:
+            raise InvalidScheduleError(path, f'{base}{quote} is scheduled more than once')
+        symbols.add(base + quote)
+        schedules.append((base, quote, amount, interval))
+    return schedules
+
+
+def apply(scheduler, schedules):
+    # Returns the symbols that couldn't be changed yet because they're mid-tick
+    current = {schedule.wallet.symbol: schedule for schedule in scheduler.schedules.values()}
+    wanted = {f'{base}{quote}': (base, quote, amount, interval) for base, quote, amount, interval in schedules}
+    time_now = clock.utcnow()
+    deferred = []
+    for symbol, schedule in current.items():
+        if symbol in wanted and (schedule.amount, schedule.interval) == wanted[symbol][2:]:
+            continue
+        if scheduler.is_firing(schedule.key):
+            deferred.append(symbol)
+            continue
+        scheduler.remove(schedule.key)
+        if symbol in wanted:
+            scheduler.add(retune(schedule, Schedule(*wanted[symbol]), time_now))
+            logger.info(f'Retuned {symbol} to {wanted[symbol][2]} {wanted[symbol][1]} every {wanted[symbol][3]}')
+        else:
+            logger.info(f'Removed {symbol} schedule')
+    for symbol, schedule in wanted.items():
+        if symbol not in current:
+            scheduler.add(Schedule(*schedule))
+            logger.info(f'Added {symbol} schedule')
+    scheduler.save_state()
+    return deferred
+
+
+def file_version(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+async def watch(scheduler, path=SCHEDULES_FILE, select=None):
+    # Polls the file for changes and applies them. `select` picks out the schedules this process runs.
+    last_version = file_version(path)
+    deferred = []
+    while True:
+        await asyncio.sleep(RELOAD_INTERVAL)
+        version = file_version(path)
+        # Schedules that were mid-tick last time are retried even if the file hasn't changed since
+        if version == last_version and not deferred:
+            continue
+        last_version = version
+        try:
+            schedules = [schedule for schedule in load(path) if select is None or select(schedule)]
+        except InvalidScheduleError as e:
+            deferred = []
+            logger.error(f'Not reloading schedules, keeping the current ones. {e}')
+            continue
+        deferred = apply(scheduler, schedules)
+        symbols = [f'{base}{quote}' for base, quote, _, _ in schedules]
+        await market_data.feed.subscribe(symbols)
+        if binance.symbol_filters.track(symbols):
+            await binance.refresh_exchange_info()
@@ -0,0 +1,210 @@
+import numpy as np
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from const import TRADE
+
+INITIAL_CAPACITY = 64
+# Buffers are kept exactly, in fixed point to this many decimal places. Enough for BTC or ETH as the quote currency.
+UNIT_PLACES = 8
+BUFFER_PLACES = Decimal(1).scaleb(-UNIT_PLACES)
+# next_tick of a schedule that hasn't been given one, and buffer_before of one that isn't mid-tick
+NO_TICK = np.iinfo(np.int64).max
+NO_BUFFER = np.iinfo(np.int64).min
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+BACKING_OFF_CODES = [TRADE.FAILURE.value, TRADE.QUOTA_FAILURE.value, TRADE.UNKNOWN.value]
+
+
+def to_buffer_value(amount):
+    # Floats (amounts from schedules) go via their shortest repr so 0.1 is 0.1 and not 0.1000000000000000055...
+    if isinstance(amount, float):
+        amount = str(amount)
+    amount = Decimal(amount)
+    # An empty buffer is 0, not 0E-8, in saved state and logs
+    if not amount:
+        return Decimal(0)
+    return amount.quantize(BUFFER_PLACES)
+
+
+def to_units(amount):
+    # Buffer value -> the whole number of BUFFER_PLACES it's held as in the store
+    return int(to_buffer_value(amount).scaleb(UNIT_PLACES))
+
+
+def from_units(units):
+    if not units:
+        return Decimal(0)
+    return Decimal(int(units)).scaleb(-UNIT_PLACES)
+
+
+def format_units(units):
+    # str(from_units(units)) without building a Decimal, as the saved state is written for every schedule at once
+    if not units:
+        return '0'
+    sign = '-' if units < 0 else ''
+    whole, fraction = divmod(abs(units), 10 ** UNIT_PLACES)
+    return f'{sign}{whole}.{fraction:0{UNIT_PLACES}d}'
+
+
+def to_micros(time):
+    # Naive UTC datetime -> microseconds since the epoch
+    return (time - EPOCH) // MICROSECOND
+
+
+def from_micros(micros):
+    return EPOCH + timedelta(microseconds=int(micros))
+
+
+# Column -> (to array value, from array value)
+CODECS = {
+    'buffer': (to_units, from_units),
+    'buffer_before': (lambda buffer: NO_BUFFER if buffer is None else to_units(buffer),
+                      lambda units: None if units == NO_BUFFER else from_units(units)),
+    'next_tick': (lambda time: NO_TICK if time is None else to_micros(time),
+                  lambda micros: None if micros == NO_TICK else from_micros(micros)),
+    'status': (lambda status: status.value, lambda code: TRADE(int(code))),
+    'paused': (bool, bool),
+}
+
+
+class Column:
+    """An attribute kept in a ScheduleStore column while its object is attached to a row, and on the object otherwise."""
+
+    def __init__(self, column):
+        self.column = column
+
+    def __set_name__(self, owner, name):
+        self.local = f'_{name}'
+
+    def __get__(self, view, owner=None):
+        if view is None:
+            return self
+        if view.store is None:
+            return getattr(view, self.local)
+        return CODECS[self.column][1](getattr(view.store, self.column)[view.row])
+
+    def __set__(self, view, value):
+        if view.store is None:
+            setattr(view, self.local, value)
+        else:
+            getattr(view.store, self.column)[view.row] = CODECS[self.column][0](value)
+
+
+def columns_of(view):
+    return [attribute for cls in type(view).__mro__ for attribute in vars(cls).values() if isinstance(attribute, Column)]
+
+
+class ScheduleStore:
+    """Schedule state held column-wise in NumPy arrays, one row per schedule, so a batch of ticks is one vectorized pass.
+
+    Schedule and Wallet objects attached to a row are views on it. Rows are reused once their schedule is detached.
+    """
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.buffer = np.zeros(capacity, np.int64)
+        self.buffer_before = np.full(capacity, NO_BUFFER, np.int64)
+        self.tick_amount = np.zeros(capacity, np.int64)
+        self.minimum = np.zeros(capacity, np.int64)
+        self.next_tick = np.full(capacity, NO_TICK, np.int64)
+        self.interval = np.zeros(capacity, np.int64)
+        self.status = np.zeros(capacity, np.int8)
+        self.paused = np.zeros(capacity, bool)
+        # Rows with a schedule attached, and those whose tick has been fired and not yet settled
+        self.in_use = np.zeros(capacity, bool)
+        self.firing = np.zeros(capacity, bool)
+        # Rows below `used` have had a schedule attached. Of those, the ones since detached are reused first.
+        self.used = 0
+        self.free_rows = []
+
+    def _grow(self):
+        capacity = len(self.in_use)
+        for name, column in list(vars(self).items()):
+            if isinstance(column, np.ndarray):
+                grown = np.resize(column, capacity * 2)
+                grown[capacity:] = {'buffer_before': NO_BUFFER, 'next_tick': NO_TICK}.get(name, 0)
+                setattr(self, name, grown)
+
+    def attach(self, schedule, minimum_order_value):
+        # `schedule` and its wallet become views on a new row, holding the values they had
+        if self.free_rows:
+            row = self.free_rows.pop()
+        else:
+            if self.used == len(self.in_use):
+                self._grow()
+            row = self.used
+            self.used += 1
+        views = (schedule, schedule.wallet)
+        values = [(view, column, column.__get__(view)) for view in views for column in columns_of(view)]
+        for view in views:
+            view.store, view.row = self, row
+        for view, column, value in values:
+            column.__set__(view, value)
+            # Only the row holds it now
+            delattr(view, column.local)
+        self.tick_amount[row] = to_units(schedule.tick_amount)
+        self.interval[row] = schedule.timedelta_interval // MICROSECOND
+        self.minimum[row] = to_units(minimum_order_value)
+        self.in_use[row] = True
+        return row
+
+    def detach(self, schedule):
+        # The views take their values back, so a detached schedule still works on its own
+        views = (schedule, schedule.wallet)
+        values = [(view, column, column.__get__(view)) for view in views for column in columns_of(view)]
+        row = schedule.row
+        for view in views:
+            view.store, view.row = None, None
+        for view, column, value in values:
+            column.__set__(view, value)
+        self.in_use[row] = self.firing[row] = False
+        self.buffer_before[row] = NO_BUFFER
+        self.next_tick[row] = NO_TICK
+        self.free_rows.append(row)
+
+    def next_due(self):
+        # Earliest next tick (microseconds) of the schedules waiting to fire, None if there are none
+        waiting = self.in_use & ~self.firing
+        if not waiting.any():
+            return None
+        return int(self.next_tick[waiting].min())
+
+    def take_due(self, now, window):
+        # Rows due by `now` plus any due within `window` after it, marked as firing. Nothing is taken early unless
+        # something else is actually due. Paused schedules skip the tick but keep their cadence.
+        waiting = self.in_use & ~self.firing
+        if not (waiting & (self.next_tick <= now)).any():
+            return np.empty(0, np.int64)
+        due = waiting & (self.next_tick <= now + window)
+        skipped = np.flatnonzero(due & self.paused)
+        self.next_tick[skipped] += self.interval[skipped]
+        rows = np.flatnonzero(due & ~self.paused)
+        # Earliest due first
+        rows = rows[np.argsort(self.next_tick[rows], kind='stable')]
+        self.firing[rows] = True
+        return rows
+
+    def add_ticks(self, rows):
+        # Remembers each buffer as it was before the tick and adds a tick's amount to those not backing off after a
+        # failed (or unknown) trade, whose buffer already has its backoff's worth. Returns the rows now worth an order.
+        self.buffer_before[rows] = self.buffer[rows]
+        growing = rows[~np.isin(self.status[rows], BACKING_OFF_CODES)]
+        self.buffer[growing] += self.tick_amount[growing]
+        return rows[self.buffer[rows] >= self.minimum[rows]]
+
+    def set_minimums(self, rows, minimum_order_values):
+        self.minimum[rows] = [to_units(value) for value in minimum_order_values]
+
+    def snapshot(self, rows):
+        # Schedule.snapshot for many rows at once, formatted straight from the arrays rather than through the views.
+        # Rows mid-tick are saved with the buffer they had before it.
+        buffers = np.where(self.buffer_before[rows] == NO_BUFFER, self.buffer[rows], self.buffer_before[rows])
+        next_ticks = np.datetime_as_string(self.next_tick[rows].astype('datetime64[us]'))
+        names = [status.name for status in sorted(TRADE, key=lambda status: status.value)]
+        return [{'buffer': format_units(units),
+                 'next_tick': next_tick,
+                 'last_status': names[code],
+                 'paused': paused}
+                for units, next_tick, code, paused in zip(buffers.tolist(), next_ticks.tolist(),
+                                                          self.status[rows].tolist(), self.paused[rows].tolist())]
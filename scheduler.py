@@ -0,0 +1,396 @@
+import asyncio
+import numpy as np
+
+from datetime import timedelta, datetime
+
+import utils, binance, clock, state, metrics, logs
+from wallet import Wallet, to_buffer_value
+from schedule_store import ScheduleStore, Column, to_micros, from_micros, MICROSECOND
+from const import *
+
+logger = logs.get_logger(__name__)
+
+# Ticks falling due within this many seconds of each other are fired together
+BATCH_WINDOW = 1
+# Fire-time drift (seconds) above which a warning is logged
+DRIFT_WARNING = 60
+# Quota-type failures (e.g. the daily FAST redemption limit) won't clear quickly. Others already had
+# their transient errors retried by the request governor, so try again sooner.
+QUOTA_FAILURE_BACKOFF = timedelta(hours=1)
+FAILURE_BACKOFF = timedelta(minutes=5)
+FAILED = (TRADE.FAILURE, TRADE.QUOTA_FAILURE)
+# A schedule backs off after any of these, and has no tick added to its buffer when it fires again. An order whose
+# outcome is unknown is looked up again first, rather than another being sent.
+BACKING_OFF = FAILED + (TRADE.UNKNOWN,)
+
+
+def retune(old, new, time_now):
+    # Carry the buffer and cadence over, so only the amount and/or interval change
+    new.wallet.buffered_dca_quote_value = old.wallet.buffered_dca_quote_value
+    new.trade_status = old.trade_status
+    new.paused = old.paused
+    new.next_tick = old.next_tick
+    new.pending_order_id = old.pending_order_id
+    if old.trade_status not in BACKING_OFF:
+        # The tick after the previous one, at the new interval. A failed schedule keeps its backoff.
+        new.next_tick = max(old.next_tick - old.timedelta_interval + new.timedelta_interval, time_now)
+    return new
+
+
+class Schedule:
+    # Column attributes live in the scheduler's ScheduleStore while the schedule is added to one
+    __slots__ = ('wallet', 'amount', 'interval', 'min_tick_denominator', 'full_requested_seconds_interval',
+                 'timedelta_interval', 'tick_amount', 'last_drift', 'active', 'pending_order_id', 'store', 'row',
+                 '_trade_status', '_next_tick', '_buffer_before_tick', '_paused')
+
+    trade_status = Column('status')
+    next_tick = Column('next_tick')
+    buffer_before_tick = Column('buffer_before')
+    paused = Column('paused')
+
+    def __init__(self, base_currency, quote_currency, amount, interval):
+        self.store = None
+        self.row = None
+        # Wallet tracks the symbol and DCA bufferred amount
+        self.wallet = Wallet(base_currency, quote_currency)
+        self.amount = amount
+        self.interval = interval
+        # Reduce oversized DCA schedules to the minimum allowed order size
+        self.min_tick_denominator = 1
+        if amount > binance.MINIMUM_ORDER_VALUE:
+            self.min_tick_denominator = amount / binance.MINIMUM_ORDER_VALUE
+        # Calculate the delta between DCA ticks
+        full_requested_timedelta = utils.parse_timedelta_string(interval)
+        self.full_requested_seconds_interval = full_requested_timedelta.total_seconds()
+        self.timedelta_interval = full_requested_timedelta / self.min_tick_denominator
+        self.tick_amount = amount / self.min_tick_denominator
+        self.trade_status = TRADE.NO_TRADE_YET
+        self.next_tick = None
+        self.last_drift = None
+        # Buffer as it was before an in-progress tick added to it, so a snapshot taken mid-tick replays the tick
+        self.buffer_before_tick = None
+        self.active = True
+        self.paused = False
+        # Client order id of the order sent whose outcome is unknown, until it's been looked up
+        self.pending_order_id = None
+
+    @property
+    def key(self):
+        return f'{self.wallet.symbol}:{self.amount}:{self.interval}'
+
+    def first_tick(self, time_now):
+        logger.info(f"Adding {self.tick_amount} {self.wallet.quote_currency} to {self.wallet.base_currency} "
+                    f"pool at an interval of {self.timedelta_interval}")
+        # Check if next tick is within last trade timestamp to prevent buying too soon after a restart
+        last_trade_datetime = utils.get_last_trade_datetime(self.wallet.symbol)
+        if last_trade_datetime == datetime.min:
+            return time_now
+        self.trade_status = TRADE.SUCCESS
+        date_of_next_tick = last_trade_datetime + self.timedelta_interval
+        if not utils.time_in_range(datetime.min, time_now, date_of_next_tick):
+            logger.info(f'Trade on {self.wallet.symbol} already occurred recently. '
+                        f'Pausing until next tick at {date_of_next_tick}')
+            return date_of_next_tick
+        return time_now
+
+    def restore(self, snapshot, saved_at):
+        self.wallet.buffered_dca_quote_value = to_buffer_value(snapshot['buffer'])
+        self.next_tick = datetime.fromisoformat(snapshot['next_tick'])
+        # A failed status means the schedule was in its backoff, which next_tick already reflects. An unknown
+        # outcome's order has no pending id to look up now, but reconcile_orders recovered it at startup if it filled.
+        self.trade_status = TRADE[snapshot['last_status']]
+        self.paused = snapshot['paused']
+        # A trade recorded after the snapshot was taken spent the buffer, so don't spend it again
+        last_trade_datetime = utils.get_last_trade_datetime(self.wallet.symbol)
+        if last_trade_datetime > saved_at:
+            self.wallet.reset_buffer()
+            self.trade_status = TRADE.SUCCESS
+            self.next_tick = max(self.next_tick, last_trade_datetime + self.timedelta_interval)
+        logger.info(f'Resumed {self.wallet.symbol} with {self.wallet.buffered_dca_quote_value} '
+                    f'{self.wallet.quote_currency} buffered. Next tick at {self.next_tick}')
+
+    def prepare(self):
+        self.buffer_before_tick = self.wallet.buffered_dca_quote_value
+        # If the previous trade did not fail (was a success or hasn't started yet), then add the full amount to the buffer
+        if self.trade_status not in BACKING_OFF:
+            self.wallet.add_dca(self.tick_amount)
+        # Check if we have enough in the buffer to trade
+        return self.wallet.buffered_dca_quote_value >= binance.symbol_filters.minimum_order_value(self.wallet.symbol)
+
+    def settle(self):
+        self.buffer_before_tick = None
+        # If it succeeds, we need to reset the buffer so we don't buy double next time!
+        if self.trade_status is TRADE.SUCCESS:
+            self.wallet.reset_buffer()
+        # It could have failed for a number of reasons, commonly, the global FAST withdrawal limit was hit for the day.
+        # Or it's unknown whether it went through, which is checked when the backoff is up.
+        if self.trade_status in BACKING_OFF:
+            backoff = QUOTA_FAILURE_BACKOFF if self.trade_status is TRADE.QUOTA_FAILURE else FAILURE_BACKOFF
+            # Figure out amount extra to buy for the delay
+            extra_tick_amount = self.amount / self.full_requested_seconds_interval * backoff.total_seconds()
+            logger.warning(f'Setting next dca tick to {backoff} to set trade backoff. '
+                           f'Adding {round(extra_tick_amount, 4)} {self.wallet.quote_currency} '
+                           f'to compensate for trade delay.')
+            self.wallet.add_dca(extra_tick_amount)
+            return backoff
+        self.trade_status = TRADE.NO_TRADE_YET
+        return self.timedelta_interval
+
+    def status(self):
+        return {'symbol': self.wallet.symbol,
+                'amount': self.amount,
+                'interval': self.interval,
+                'buffer': float(self.wallet.buffered_dca_quote_value),
+                'next_tick': self.next_tick,
+                'last_status': self.trade_status.name,
+                'last_drift': self.last_drift,
+                'paused': self.paused}
+
+
+class Scheduler:
+    """Runs every schedule from one ScheduleStore, using a single timer.
+
+    Due ticks are found, and their buffers grown and checked against the minimum order value, a batch
+    at a time with vectorized passes over the store, so very large numbers of schedules stay cheap.
+    """
+
+    def __init__(self, schedules=(), state_path=None):
+        self.store = ScheduleStore()
+        # store row -> schedule
+        self.by_row = {}
+        # symbol_filters version the store's minimum order values were read at
+        self.filters_version = binance.symbol_filters.version
+        self.schedules = {}
+        self.wakeup = None
+        self.tasks = set()
+        self.failure = None
+        # Schedule state is resumed from, and periodically snapshotted to, state_path when given
+        self.state_path = state_path
+        self.save_handle = None
+        self.saved_state = None
+        # symbol -> key of its schedule in saved_state
+        self.saved_keys = {}
+        if state_path is not None:
+            self.saved_state = state.load(state_path)
+        if self.saved_state is not None:
+            self.saved_keys = {key.split(':')[0]: key for key in self.saved_state['schedules']}
+        for schedule in schedules:
+            self.add(schedule)
+        # Only the schedules the bot starts with resume. One added later (say removed from the schedules file
+        # and put back) starts afresh rather than from a snapshot that's out of date by then.
+        self.saved_state = None
+        self.saved_keys = {}
+
+    def add(self, schedule):
+        if schedule.key in self.schedules:
+            raise ValueError(f'Schedule {schedule.key} already exists')
+        self.schedules[schedule.key] = schedule
+        if schedule.next_tick is None and schedule.wallet.symbol in self.saved_keys:
+            self._resume(schedule)
+        if schedule.next_tick is None:
+            schedule.next_tick = schedule.first_tick(clock.utcnow())
+        row = self.store.attach(schedule, binance.symbol_filters.minimum_order_value(schedule.wallet.symbol))
+        self.by_row[row] = schedule
+        self._wake()
+
+    def _resume(self, schedule):
+        # Snapshots are matched by symbol, like schedules file reloads, so one whose amount or interval was
+        # edited while the bot was stopped keeps its buffer and carries on from its last tick
+        saved_at = datetime.fromisoformat(self.saved_state['saved_at'])
+        key = self.saved_keys[schedule.wallet.symbol]
+        snapshot = self.saved_state['schedules'][key]
+        if key == schedule.key:
+            schedule.restore(snapshot, saved_at)
+            return
+        symbol, amount, interval = key.split(':')
+        saved = Schedule(schedule.wallet.base_currency, schedule.wallet.quote_currency, float(amount), interval)
+        saved.restore(snapshot, saved_at)
+        retune(saved, schedule, clock.utcnow())
+        logger.info(f'Retuned {symbol} from {amount} every {interval} to {schedule.amount} every {schedule.interval}')
+
+    def remove(self, key):
+        schedule = self.schedules.pop(key)
+        schedule.active = False
+        # A schedule that's mid-tick keeps its row until the tick has settled
+        if not self.store.firing[schedule.row]:
+            self._detach(schedule)
+        self._wake()
+        return schedule
+
+    def is_firing(self, key):
+        # From when its tick is taken off the store until it has settled, including before the buffer is touched
+        return bool(self.store.firing[self.schedules[key].row])
+
+    def _detach(self, schedule):
+        del self.by_row[schedule.row]
+        self.store.detach(schedule)
+
+    def pause(self, key):
+        self.schedules[key].paused = True
+
+    def resume(self, key):
+        self.schedules[key].paused = False
+        self._wake()
+
+    def status(self):
+        return [schedule.status() for schedule in self.schedules.values()]
+
+    def snapshot(self):
+        # Schedules that are mid-tick are saved as they were before it fired; the ledger covers any trade it makes
+        rows = np.fromiter((schedule.row for schedule in self.schedules.values()), np.int64, len(self.schedules))
+        return {'saved_at': clock.utcnow().isoformat(),
+                'schedules': dict(zip(self.schedules, self.store.snapshot(rows)))}
+
+    def save_state(self):
+        if self.state_path is not None:
+            state.save(self.snapshot(), self.state_path)
+
+    def _save_soon(self):
+        if self.state_path is not None and self.save_handle is None:
+            self.save_handle = asyncio.get_running_loop().call_later(state.SAVE_DELAY, self._save_now)
+
+    def _save_now(self):
+        self.save_handle = None
+        self.save_state()
+
+    async def _snapshot_periodically(self):
+        while True:
+            await asyncio.sleep(state.SNAPSHOT_INTERVAL)
+            self.save_state()
+
+    def _wake(self):
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def _pop_due(self, time_now):
+        # Nothing is fired early unless something else is actually due, so it can join that batch
+        rows = self.store.take_due(to_micros(time_now), timedelta(seconds=BATCH_WINDOW) // MICROSECOND)
+        return [self.by_row[row] for row in rows.tolist()]
+
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        snapshot_task = None
+        if self.state_path is not None:
+            snapshot_task = asyncio.ensure_future(self._snapshot_periodically())
+        try:
+            await self._run()
+        finally:
+            if snapshot_task is not None:
+                snapshot_task.cancel()
+            if self.save_handle is not None:
+                self.save_handle.cancel()
+                self.save_handle = None
+            self.save_state()
+
+    async def _run(self):
+        while True:
+            if self.failure is not None:
+                raise self.failure
+            self.wakeup.clear()
+            time_now = clock.utcnow()
+            due = self._pop_due(time_now)
+            if due:
+                task = asyncio.ensure_future(self._fire(due, time_now))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+                continue
+            # Sleep until the earliest tick (re-reading the wall clock on wake so sleep overshoot never accumulates)
+            timeout = None
+            next_due = self.store.next_due()
+            if next_due is not None:
+                timeout = max((from_micros(next_due) - time_now).total_seconds(), 0)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _refresh_minimums(self):
+        # Minimum order values are cached in the store, so re-read them whenever the exchange filters change
+        if self.filters_version == binance.symbol_filters.version:
+            return
+        self.filters_version = binance.symbol_filters.version
+        rows = list(self.by_row)
+        self.store.set_minimums(rows, [binance.symbol_filters.minimum_order_value(self.by_row[row].wallet.symbol)
+                                       for row in rows])
+
+    def _prepare(self, schedules):
+        # Schedule.prepare for the whole batch in one pass: each buffer grows by a tick (unless its last trade
+        # failed) and those now worth an order are returned
+        self._refresh_minimums()
+        rows = self.store.add_ticks(np.array([schedule.row for schedule in schedules], np.int64))
+        logger.debug(f'Ticked {len(schedules)} schedules, {len(rows)} ready to trade')
+        return [self.by_row[row] for row in rows.tolist()]
+
+    async def _resolve(self, schedule):
+        # Looks up the order whose outcome was unknown. Returns whether the schedule can tick, which it only can
+        # once that order is known not to have gone through. One that did counts as this tick's trade.
+        symbol, client_order_id = schedule.wallet.symbol, schedule.pending_order_id
+        response = await binance.find_order(symbol, client_order_id)
+        if response is None:
+            logger.error(f"Still couldn't check whether {symbol} order {client_order_id} went through")
+            return False
+        schedule.pending_order_id = None
+        if response is False:
+            logger.warning(f'{symbol} order {client_order_id} was not placed. Trading the buffer again.')
+            return True
+        logger.warning(f'{symbol} order {client_order_id} went through. Recording it.')
+        utils.parse_market_buy(response)
+        schedule.trade_status = TRADE.SUCCESS
+        return False
+
+    async def _tick(self, schedules):
+        ticking = schedules
+        pending = [schedule for schedule in schedules if schedule.pending_order_id is not None]
+        if pending:
+            resolved = await asyncio.gather(*(self._resolve(schedule) for schedule in pending))
+            held = {id(schedule) for schedule, can_tick in zip(pending, resolved) if not can_tick}
+            ticking = [schedule for schedule in schedules if id(schedule) not in held]
+        ready = self._prepare(ticking)
+        if ready:
+            # Check we're not in the Binance Earn rewards period where you can't withdraw. If we are, wait until it's finished.
+            is_locked, timedelta_to_unlock = binance.savings_lock_check()
+            if is_locked:
+                logger.info(f'Savings withdraw unavailable. Waiting until unlock.')
+                await asyncio.sleep(timedelta_to_unlock.total_seconds())
+            # Orders are identified by their schedule and the tick they're for, which stays the same if the tick is
+            # replayed after a restart
+            client_order_ids = {id(schedule.wallet): binance.client_order_id_for(schedule.wallet.symbol,
+                                                                                 schedule.next_tick, schedule.key)
+                                for schedule in ready}
+            # Every order due in this batch shares one balance snapshot, fee top-up and redemption per quote currency
+            statuses = await binance.transact_batch([(schedule.wallet, schedule.wallet.buffered_dca_quote_value)
+                                                     for schedule in ready], client_order_ids)
+            for schedule, status in zip(ready, statuses):
+                schedule.trade_status = status
+                # Looked up by this id before the schedule sends another order, so it can't be bought twice
+                if status is TRADE.UNKNOWN:
+                    schedule.pending_order_id = client_order_ids[id(schedule.wallet)]
+        return [schedule.settle() for schedule in schedules]
+
+    async def _fire(self, schedules, time_now):
+        for schedule in schedules:
+            schedule.last_drift = (time_now - schedule.next_tick).total_seconds()
+            metrics.TICK_DRIFT.observe(max(schedule.last_drift, 0))
+            if schedule.last_drift > DRIFT_WARNING:
+                logger.warning(f'{schedule.wallet.symbol} tick fired {round(schedule.last_drift)}s late')
+        try:
+            with metrics.span('tick', symbols=[schedule.wallet.symbol for schedule in schedules]):
+                delays = await self._tick(schedules)
+        except Exception as e:
+            logger.exception('Scheduled tick crashed')
+            self.failure = e
+            self._wake()
+            return
+        time_now = clock.utcnow()
+        for schedule, delay in zip(schedules, delays):
+            self.store.firing[schedule.row] = False
+            if not schedule.active:
+                self._detach(schedule)
+                continue
+            # Next tick is relative to when this one was due, not when it finished, so drift doesn't build up.
+            # If it ran so long that tick is already past, fire as soon as possible instead of bursting.
+            schedule.next_tick = max(schedule.next_tick + delay, time_now)
+        self._wake()
+        # Buffers were spent or grown, so save soon rather than waiting for the next periodic snapshot. Not straight
+        # away: every save writes all the schedules, and batches settling within SAVE_DELAY of each other share one.
+        self._save_soon()
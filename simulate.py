@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""Run the real scheduler and trade code against the local fake exchange on a virtual clock.
+
+The event loop never sleeps: whenever nothing is ready it jumps straight to the next timer, and
+every wall clock read the bot makes (tick times, the savings lock window, request timestamps) comes
+from the same virtual clock. Months of schedule activity pass in seconds.
+
+The result is a timeline of ticks, buffers, redemptions and fills, one event per line with its
+virtual time, so runs can be diffed between versions. The same schedules, start, duration and seed
+always give the same timeline.
+"""
+import argparse
+import asyncio
+import logging
+import math
+import random
+import selectors
+import sys
+import time
+
+from collections import Counter
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import config, binance, clock, analytics, liquidity, schedule_file, utils, logs
+from scheduler import Schedule, Scheduler, FAILED, BACKING_OFF
+from const import TRADE
+from fake_exchange import FakeExchange
+
+DEFAULT_START = '2024-01-01T00:00:00'
+DEFAULT_DURATION = '90d'
+
+
+class VirtualClock:
+    def __init__(self, start):
+        # `start` is a naive UTC datetime
+        self.start = start.replace(tzinfo=timezone.utc).timestamp()
+        self.elapsed = 0.0
+
+    def advance(self, seconds):
+        # Always moves forward, even by less than float precision allows at this elapsed time
+        self.elapsed = max(self.elapsed + seconds, math.nextafter(self.elapsed, math.inf))
+
+    def monotonic(self):
+        return self.elapsed
+
+    def time(self):
+        return self.start + self.elapsed
+
+
+class VirtualTimeSelector:
+    """Selector that, rather than blocking until the next timer is due, advances the virtual clock to it."""
+
+    def __init__(self, virtual_clock):
+        self.selector = selectors.DefaultSelector()
+        self.clock = virtual_clock
+
+    def select(self, timeout=None):
+        # The fake exchange runs on this loop, so anything it has sent is already readable. Nothing
+        # readable means nothing will be until a timer fires.
+        events = self.selector.select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            # No timers at all, so only real I/O can wake the loop
+            return self.selector.select()
+        self.clock.advance(timeout)
+        return []
+
+    def __getattr__(self, name):
+        return getattr(self.selector, name)
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    def __init__(self, virtual_clock):
+        self.clock = virtual_clock
+        super().__init__(VirtualTimeSelector(virtual_clock))
+
+    def time(self):
+        return self.clock.monotonic()
+
+
+class Timeline:
+    def __init__(self):
+        self.lines = []
+        self.counts = Counter()
+
+    def record(self, event, subject, detail=''):
+        self.counts[event] += 1
+        self.lines.append(f'{clock.utcnow():%Y-%m-%d %H:%M:%S}  {event:<7} {subject:<9} {detail}'.rstrip())
+
+
+class RecordingScheduler(Scheduler):
+    def __init__(self, schedules, timeline):
+        super().__init__(schedules)
+        self.timeline = timeline
+
+    async def _fire(self, schedules, time_now):
+        for schedule in schedules:
+            self.timeline.record('tick', schedule.wallet.symbol,
+                                 f'buffer={schedule.wallet.buffered_dca_quote_value:.8f}')
+        await super()._fire(schedules, time_now)
+        for schedule in schedules:
+            status = schedule.trade_status.name if schedule.trade_status in BACKING_OFF else 'ok'
+            self.timeline.counts[status] += 1
+            self.timeline.record('settle', schedule.wallet.symbol,
+                                 f'{status} buffer={schedule.wallet.buffered_dca_quote_value:.8f} '
+                                 f'next={schedule.next_tick:%Y-%m-%d %H:%M:%S}')
+
+
+class RecordingExchange(FakeExchange):
+    def __init__(self, timeline, **kwargs):
+        super().__init__(**kwargs)
+        self.timeline = timeline
+
+    async def lending_redeem(self, request):
+        count = len(self.redemptions)
+        response = await super().lending_redeem(request)
+        for redemption in self.redemptions[count:]:
+            self.timeline.record('redeem', redemption['asset'], f"{redemption['amount']:.8f} {redemption['type']}")
+        return response
+
+    async def order(self, request):
+        count = len(self.orders)
+        response = await super().order(request)
+        for order in self.orders[count:]:
+            self.timeline.record('fill', order['symbol'], f"quote={order['cummulativeQuoteQty']} "
+                                                          f"qty={order['executedQty']} "
+                                                          f"price={order['fills'][0]['price']}")
+        return response
+
+
+async def simulate(schedules, duration, timeline, args):
+    exchange = RecordingExchange(timeline, latency=args.latency, error_rate=args.error_rate,
+                                 lost_response_rate=args.lost_response_rate, clock=clock.source,
+                                 normal_redemption_delay=liquidity.NORMAL_REDEMPTION_DELAY.total_seconds(),
+                                 fast_redemption_limit=args.fast_limit)
+    # Quote currencies start in Earn, so every purchase has to redeem first
+    for _, quote_currency, _, _ in schedules:
+        exchange.spot[quote_currency] = 0
+        exchange.earn[quote_currency] = args.earn
+    binance.BASE_URL = await exchange.start()
+    scheduler = RecordingScheduler([Schedule(*schedule) for schedule in schedules], timeline)
+    binance.symbol_filters.track(schedule.wallet.symbol for schedule in scheduler.schedules.values())
+    await binance.refresh_exchange_info()
+    failure = None
+    horizon = None if args.liquidity_horizon == 'off' else args.liquidity_horizon
+    planner = asyncio.ensure_future(liquidity.keep_funded(scheduler, horizon))
+    try:
+        await asyncio.wait_for(scheduler.run(), duration.total_seconds())
+    except asyncio.TimeoutError:
+        pass
+    except Exception as e:
+        # A crashed tick stops the scheduler, as it would the bot
+        failure = e
+    finally:
+        planner.cancel()
+        # Let in-flight ticks finish so their fills are on the timeline
+        if scheduler.tasks:
+            await asyncio.wait(scheduler.tasks)
+        await binance.close_session()
+        await exchange.stop()
+    return exchange, failure
+
+
+def report(exchange, failure, timeline, duration, real_seconds):
+    spent = Counter()
+    for order in exchange.orders:
+        spent[order['symbol']] += Decimal(order['cummulativeQuoteQty'])
+    failures = sum(timeline.counts[status.name] for status in FAILED)
+    print(f'Simulated {duration} in {real_seconds:.1f}s: {timeline.counts["tick"]} ticks, '
+          f'{timeline.counts["fill"]} fills, {timeline.counts["redeem"]} redemptions, {failures} failed ticks, '
+          f'{timeline.counts[TRADE.UNKNOWN.name]} unknown outcomes', file=sys.stderr)
+    for symbol, quantity in sorted(spent.items()):
+        print(f'{symbol:>12}: {quantity:.8f} spent', file=sys.stderr)
+    if failure is not None:
+        print(f'Scheduler crashed: {failure!r}', file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate schedules against a local fake exchange on a virtual clock.')
+    parser.add_argument('--schedules', default=getattr(config, 'SCHEDULES_FILE', schedule_file.SCHEDULES_FILE),
+                        help='Schedules file to simulate (default: the one the bot runs)')
+    parser.add_argument('--start', default=DEFAULT_START, help='Virtual UTC time to start at (ISO format)')
+    parser.add_argument('--duration', default=DEFAULT_DURATION, help='Virtual time to run for, e.g. 90d or 2w')
+    parser.add_argument('--timeline', default='-', help='File to write the timeline to (default: stdout)')
+    parser.add_argument('--earn', type=float, default=10 ** 6, help='Earn balance of each quote currency')
+    parser.add_argument('--latency', type=float, default=0.05, help='Fake exchange response latency in virtual seconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of requests answered with a 503')
+    parser.add_argument('--lost-response-rate', type=float, default=0,
+                        help='Fraction of orders and redemptions that go through but are answered with a timeout')
+    parser.add_argument('--fast-limit', type=int, help='FAST redemptions the exchange allows per asset per day')
+    parser.add_argument('--liquidity-horizon', default=getattr(config, 'LIQUIDITY_HORIZON', None),
+                        help='Forecast horizon of the redemption planner, or "off" (default: as configured)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the fake exchange\'s random errors and lost responses')
+    parser.add_argument('--verbose', action='store_true', help='Log to the console (never to Telegram)')
+    args = parser.parse_args()
+
+    if args.verbose:
+        logs.setup(alerts=False)
+    else:
+        logging.disable(logging.CRITICAL)
+    schedules = schedule_file.load(args.schedules)
+    duration = utils.parse_timedelta_string(args.duration)
+    random.seed(args.seed)
+    # Keep simulated trades out of the real ledger and analytics
+    analytics.use_temporary_files()
+
+    virtual_clock = VirtualClock(datetime.fromisoformat(args.start))
+    clock.source = virtual_clock.time
+    timeline = Timeline()
+    loop = VirtualTimeLoop(virtual_clock)
+    started = time.perf_counter()
+    try:
+        exchange, failure = loop.run_until_complete(simulate(schedules, duration, timeline, args))
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+    real_seconds = time.perf_counter() - started
+
+    if args.timeline == '-':
+        sys.stdout.writelines(line + '\n' for line in timeline.lines)
+    else:
+        with open(args.timeline, 'w') as f:
+            f.writelines(line + '\n' for line in timeline.lines)
+    report(exchange, failure, timeline, duration, real_seconds)
+    sys.exit(0 if failure is None else 1)
+
+
+if __name__ == "__main__":
+    main()
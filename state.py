@@ -0,0 +1,34 @@
+import os
+import json
+
+import logs
+
+logger = logs.get_logger(__name__)
+
+STATE_FILE = 'state.json'
+# Seconds between periodic snapshots of schedule state
+SNAPSHOT_INTERVAL = 60
+# Seconds a save after trades settle waits, so batches settling close together share it
+SAVE_DELAY = 1
+
+
+def save(snapshot, path=STATE_FILE):
+    # Write to a temporary file, fsync and swap it in so a crash leaves either the old or the new snapshot
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        # dumps uses the C encoder where dump doesn't, which matters with a snapshot entry for every schedule
+        f.write(json.dumps(snapshot))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load(path=STATE_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        logger.error(f'Ignoring unreadable state snapshot {path}')
+        return None
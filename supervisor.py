@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""Run the schedules of every account in config.ACCOUNTS across a pool of worker processes.
+
+Each worker has its own event loop, HTTP session, rate limit budget and ledger/state partition
+(accounts/<name>/<shard>/), so one account's slow or failing API calls never hold up another's ticks.
+Workers report health, metrics and alerts back over a queue and the supervisor serves and sends them.
+"""
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+import zlib
+
+import config, telegram, metrics, logs
+
+logger = logs.get_logger(__name__)
+
+DATA_DIR = 'accounts'
+# Seconds without a heartbeat before a worker is reported unresponsive
+HEARTBEAT_TIMEOUT = 60
+STOP_TIMEOUT = 30
+
+
+def shard_of(schedule, shard_count):
+    # Stable across restarts so a symbol always finds its trade history in the same partition
+    base_currency, quote_currency = schedule[0], schedule[1]
+    return zlib.crc32(f'{base_currency}{quote_currency}'.encode()) % shard_count
+
+
+def plan(accounts, data_dir=DATA_DIR):
+    # Split each account's schedules over its `workers` (default 1) processes.
+    # Schedules can be listed in the config or kept in a schedules file, which is then watched for changes.
+    # Imported here because it pulls in binance, which a worker mustn't do until its account's keys are set
+    import schedule_file
+    workers = []
+    for account in accounts:
+        shard_count = account.get('workers', 1)
+        schedules_path = None
+        all_schedules = account['schedules']
+        if isinstance(all_schedules, str):
+            schedules_path = os.path.abspath(all_schedules)
+            all_schedules = schedule_file.load(schedules_path)
+        for shard in range(shard_count):
+            schedules = [schedule for schedule in all_schedules if shard_of(schedule, shard_count) == shard]
+            # Without a file to add schedules from later, an empty shard has nothing to do
+            if not schedules and schedules_path is None:
+                continue
+            workers.append({'name': account['name'] if shard_count == 1 else f"{account['name']}/{shard}",
+                            'account': account,
+                            'shard': shard,
+                            'shard_count': shard_count,
+                            'schedules': schedules,
+                            'schedules_path': schedules_path,
+                            'data_dir': os.path.abspath(os.path.join(data_dir, account['name'], str(shard)))})
+    return workers
+
+
+def start_worker(name, account, schedules, schedules_path, shard, shard_count, ip_share, data_dir, events):
+    # Runs in a freshly spawned process. The account's keys have to be in config before binance and utils read them.
+    logs.setup()
+    config.API_KEY = account['api_key']
+    config.API_SECRET = account['api_secret']
+    telegram.set_sender(config.TELEGRAM_USER_ID, telegram.QueueSender(events, name))
+    import governor, worker
+    governor.governor = governor.RequestGovernor(ip_share, 1 / shard_count)
+    os.makedirs(data_dir, exist_ok=True)
+    os.chdir(data_dir)
+    try:
+        asyncio.run(worker.run(name, schedules, events, schedules_path,
+                               lambda schedule: shard_of(schedule, shard_count) == shard))
+    except (asyncio.CancelledError, KeyboardInterrupt):
+        pass
+
+
+class Supervisor:
+    def __init__(self, accounts, data_dir=DATA_DIR):
+        # Spawned rather than forked so workers don't inherit sessions, threads or an event loop
+        self.context = multiprocessing.get_context('spawn')
+        self.events = self.context.Queue()
+        self.workers = {worker['name']: worker for worker in plan(accounts, data_dir)}
+
+    def start(self):
+        # Request weight is limited per IP, so it's shared between every worker on this machine
+        ip_share = 1 / len(self.workers)
+        for name, worker in self.workers.items():
+            worker['process'] = self.context.Process(target=start_worker, name=f'worker-{name}', daemon=True,
+                                                     args=(name, worker['account'], worker['schedules'],
+                                                           worker['schedules_path'], worker['shard'],
+                                                           worker['shard_count'], ip_share, worker['data_dir'],
+                                                           self.events))
+            worker['process'].start()
+            worker['last_seen'] = time.monotonic()
+            worker['unresponsive'] = False
+            worker['health'] = []
+            worker['metrics'] = []
+            logger.info(f"Started worker {name} with {len(worker['schedules'])} schedules")
+
+    def stop(self):
+        for worker in self.workers.values():
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+        for worker in self.workers.values():
+            worker['process'].join(STOP_TIMEOUT)
+
+    def _next_event(self):
+        try:
+            return self.events.get(timeout=1)
+        except queue.Empty:
+            return None
+
+    def handle(self, event):
+        kind, name, payload = event
+        if kind == 'alert':
+            telegram.get_sender(config.TELEGRAM_USER_ID).send(f'[{name}] {payload}')
+        elif kind == 'heartbeat':
+            worker = self.workers[name]
+            worker['last_seen'] = time.monotonic()
+            worker['health'] = payload['schedules']
+            worker['metrics'] = payload['metrics']
+            if worker['unresponsive']:
+                worker['unresponsive'] = False
+                logger.info(f'Worker {name} is responding again')
+
+    def check_workers(self):
+        # Dead workers are not restarted, for the same reason the service isn't: to prevent duplicate spending
+        now = time.monotonic()
+        for name, worker in self.workers.items():
+            process = worker['process']
+            if not process.is_alive():
+                if not worker.get('exit_reported'):
+                    worker['exit_reported'] = True
+                    logger.error(f"Worker {name} exited with code {process.exitcode}. "
+                                 f"Its {len(worker['schedules'])} schedules are stopped.")
+            elif now - worker['last_seen'] > HEARTBEAT_TIMEOUT and not worker['unresponsive']:
+                worker['unresponsive'] = True
+                logger.warning(f"Worker {name} hasn't reported in {round(now - worker['last_seen'])}s")
+        return any(worker['process'].is_alive() for worker in self.workers.values())
+
+    def health(self):
+        return {name: {'alive': worker['process'].is_alive(),
+                       'unresponsive': worker['unresponsive'],
+                       'seconds_since_heartbeat': round(time.monotonic() - worker['last_seen'], 1),
+                       'schedules': worker['health']}
+                for name, worker in self.workers.items()}
+
+    def render_metrics(self):
+        # Every worker's samples carry a worker label, so families just need merging
+        families = {}
+        for worker in self.workers.values():
+            for name, help, type, samples in worker['metrics']:
+                families.setdefault(name, (name, help, type, []))[3].extend(samples)
+        return metrics.render(list(families.values()))
+
+    async def run(self):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        metrics_port = getattr(config, 'METRICS_PORT', None)
+        if metrics_port is not None:
+            await metrics.serve(port=metrics_port, render=self.render_metrics, health=self.health)
+        self.start()
+        loop = asyncio.get_running_loop()
+        while True:
+            event = await loop.run_in_executor(None, self._next_event)
+            if event is not None:
+                self.handle(event)
+            if not self.check_workers():
+                logger.error('Every worker has exited')
+                return False
+
+
+def main():
+    logs.setup()
+    accounts = getattr(config, 'ACCOUNTS', None)
+    if not accounts:
+        logger.error('No ACCOUNTS in config. Run main.py for a single account.')
+        sys.exit(1)
+    supervisor = Supervisor(accounts)
+    try:
+        healthy = asyncio.run(supervisor.run())
+    except (asyncio.CancelledError, KeyboardInterrupt):
+        healthy = True
+    finally:
+        supervisor.stop()
+    sys.exit(0 if healthy else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,161 @@
-import requests
-import coloredlogs, logging
-
-logger = logging.getLogger(__name__)
-coloredlogs.install(level='DEBUG')
+import queue
+import threading
+import atexit
+import random
+import time
+import logging
 
 import config
 
+# Not given the alert handler, so a failure to send alerts is never itself sent as an alert
+logger = logging.getLogger(__name__)
+
 TELEGRAM_BASE_URL = f'https://api.telegram.org/bot{config.BOT_TOKEN}'
+# Telegram allows roughly one message per second to a single chat
+MIN_SEND_INTERVAL = 1.1
+# How long to hold the first message of a burst so the rest of it can be merged in
+BATCH_WINDOW = 0.5
+MAX_MESSAGE_LENGTH = 4096
+MAX_SEND_ATTEMPTS = 5
+REQUEST_TIMEOUT = 10
 
+# requests is imported where it's used. It's most of the start up time of a notification, which
+# is the first thing to run after a crash or reboot.
 def get_me():
+    import requests
     r = requests.get(TELEGRAM_BASE_URL + '/getMe')
     logging.info(f'Code: {r.status_code}. Res: {r.text}')
 
-def send_message(user_id, message):
+def send_message(user_id, message, session=None):
+    if session is None:
+        import requests
+        session = requests
     params = {'chat_id': user_id,
               'text': message}
-    r = requests.get(TELEGRAM_BASE_URL + '/sendMessage',
-                     params=params)
+    r = session.get(TELEGRAM_BASE_URL + '/sendMessage',
+                    params=params,
+                    timeout=REQUEST_TIMEOUT)
     logging.info(f'Code: {r.status_code}. Res: {r.text}')
+    return r
+
+
+class TelegramSender:
+    """Queues messages for one chat and delivers them from a background thread.
+
+    Bursts are merged into as few messages as possible and sends are spaced to stay under
+    Telegram's per-chat rate limit, so callers never wait on the network.
+    """
+
+    def __init__(self, user_id):
+        import requests
+        self.user_id = user_id
+        self.queue = queue.Queue()
+        self.session = requests.Session()
+        self.last_sent = 0
+        self.worker = threading.Thread(target=self._run,
+                                       name=f'telegram-{user_id}',
+                                       daemon=True)
+        self.worker.start()
+
+    def send(self, message):
+        self.queue.put(message)
+
+    def flush(self, timeout=30):
+        # Wait for everything queued so far to be delivered (or given up on)
+        deadline = time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            messages = [self.queue.get()]
+            time.sleep(max(BATCH_WINDOW, self.last_sent + MIN_SEND_INTERVAL - time.monotonic()))
+            while True:
+                try:
+                    messages.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for batch in self._merge(messages):
+                self._deliver(batch)
+            for _ in messages:
+                self.queue.task_done()
+
+    def _merge(self, messages):
+        batch = ''
+        for message in messages:
+            message = message[:MAX_MESSAGE_LENGTH]
+            if batch and len(batch) + len(message) + 2 > MAX_MESSAGE_LENGTH:
+                yield batch
+                batch = ''
+            batch = f'{batch}\n\n{message}' if batch else message
+        if batch:
+            yield batch
+
+    def _deliver(self, message):
+        import requests
+        for attempt in range(MAX_SEND_ATTEMPTS):
+            wait = self.last_sent + MIN_SEND_INTERVAL - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            retry_after = None
+            try:
+                r = send_message(self.user_id, message, session=self.session)
+                self.last_sent = time.monotonic()
+                if r.ok:
+                    return True
+                if r.status_code == 429:
+                    retry_after = r.json().get('parameters', {}).get('retry_after')
+                elif r.status_code < 500:
+                    # Anything else in the 4xx range will fail the same way again
+                    break
+            except (requests.RequestException, ValueError) as e:
+                logger.debug(f'Telegram send failed: {e!r}')
+            time.sleep(retry_after or min(2 ** attempt, 30) + random.random())
+        logger.error(f'Giving up on Telegram message to {self.user_id}: {message}')
+        return False
+
+
+class QueueSender:
+    """Forwards messages to a multiprocessing queue for another process (the supervisor) to deliver."""
+
+    def __init__(self, queue, source):
+        self.queue = queue
+        self.source = source
+
+    def send(self, message):
+        self.queue.put(('alert', self.source, message))
+
+    def flush(self, timeout=30):
+        return True
+
+
+_senders = {}
+_senders_lock = threading.Lock()
+
+
+def get_sender(user_id):
+    with _senders_lock:
+        if user_id not in _senders:
+            _senders[user_id] = TelegramSender(user_id)
+        return _senders[user_id]
+
+
+def set_sender(user_id, sender):
+    # Route a chat's messages through something else with send() and flush() (e.g. a supervisor's queue)
+    with _senders_lock:
+        _senders[user_id] = sender
+
+
+@atexit.register
+def flush_all(timeout=30):
+    for sender in list(_senders.values()):
+        sender.flush(timeout)
+
 
 class TelegramHandler(logging.Handler):
     def __init__(self, user_id):
@@ -30,7 +168,7 @@ class TelegramHandler(logging.Handler):
             emoji = "ℹ"
         elif record.levelname == 'WARNING':
             emoji = "⚠️"
-        elif (record.levelname == 'ERROR' or 
+        elif (record.levelname == 'ERROR' or
               record.levelname == 'CRITICAL'):
             emoji = "🚨"
 
@@ -38,4 +176,4 @@ class TelegramHandler(logging.Handler):
         # Override here with proper emoji.
         if record.funcName == 'parse_market_buy':
             emoji = "💸"
-        send_message(self.user_id, f'{emoji} {record.msg}')
\ No newline at end of file
+        get_sender(self.user_id).send(f'{emoji} {record.msg}')
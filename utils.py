@@ -2,21 +2,14 @@ import hmac
 import hashlib
 import urllib
 import re
-import time
-import logging, coloredlogs
-import json
-import sys
 
-from datetime import timedelta, datetime, date
+from datetime import timedelta
 
 from config import *
-import telegram
+import ledger, clock, analytics, logs
+from exceptions import InvalidIntervalStringError
 
-logger = logging.getLogger(__name__)
-coloredlogs.install(level='DEBUG')
-telegram_handler = telegram.TelegramHandler(TELEGRAM_USER_ID)
-telegram_handler.setLevel(logging.INFO)
-logger.addHandler(telegram_handler)
+logger = logs.get_logger(__name__)
 
 def filter_coins(wallet, coins):
     filtered_coins = []
@@ -43,62 +36,41 @@ def hash(params):
                     hashlib.sha256).hexdigest()
 
 def sign(params):
-    params['timestamp'] = round(time.time()*1000)
+    params['timestamp'] = clock.now_ms()
     params['signature'] = hash(params)
     logger.debug(params)
     return params
 
 def parse_timedelta_string(interval_string):
     regex = re.compile(r'((?P<weeks>\d+?)w)?((?P<days>\d+?)d)?((?P<hours>\d+?)h)?((?P<minutes>\d+?)m)?((?P<seconds>\d+?)s)?')
-    time_parts = regex.match(interval_string)
+    time_parts = regex.fullmatch(interval_string) if isinstance(interval_string, str) else None
     if not time_parts:
-        logger.critical('The timedelta string interval is invalid.')
-        exit(-1)
+        raise InvalidIntervalStringError(interval_string)
     timedelta_parts = {name: float(param) for name, param in time_parts.groupdict().items() if param}
-    if len(timedelta_parts) == 0:
-        logger.critical('The timedelta string interval is invalid.')
-        sys.exit('The timedelta string interval is invalid.')
+    if not timedelta_parts or timedelta(**timedelta_parts).total_seconds() <= 0:
+        raise InvalidIntervalStringError(interval_string)
     return timedelta(**timedelta_parts)
 
 
 def open_trades_file():
-    with open('trades.json') as json_file:
-        data = json.load(json_file)
-        return data
+    return {'trades': list(ledger.get_ledger().trades())}
 
 
 def append_to_file(json_buy_res):
-    data = open_trades_file()
-    current_trades = data['trades']
-    current_trades.append(json_buy_res)
-
-    with open('trades.json','w') as f:
-        json.dump(data, f)
+    ledger.get_ledger().append(json_buy_res)
 
 
 def get_last_trade_datetime(trade_symbol):
-    data = open_trades_file()
-    filtered_trades = []
-    if len(data['trades']) > 0:
-        for trade in data['trades']:
-            if trade['symbol'] == trade_symbol:
-                filtered_trades.append(trade)
-        if len(filtered_trades) > 0:
-            max_date_trade_entry = max(filtered_trades, key=lambda x:x['transactTime'])
-            max_date = datetime.fromtimestamp(max_date_trade_entry['transactTime']/1000)
-            return max_date
-    return datetime.min
+    return ledger.get_ledger().last_trade_datetime(trade_symbol)
 
     
 def parse_market_buy(response):
     append_to_file(response)
-    price_pre_mean = 0
-    quantity = 0
-    commission = 0
-    for fill in response['fills']:
-       price_pre_mean += float(fill['price'])
-       quantity += float(fill['qty'])
-       commission += float(fill['commission'])
-    avg_fill_price = price_pre_mean / len(response['fills'])
-    logger.warning(f"Purchased {quantity} {response['symbol']} @ {avg_fill_price} ({response['cummulativeQuoteQty']})")
-    return response['cummulativeQuoteQty']
\ No newline at end of file
+    analytics.get_analytics().record(response)
+    quantity, quote, fees = analytics.summarise_fills(response['fills'])
+    # Quantity weighted, so this is the price actually paid across all the fills
+    avg_fill_price = quote / quantity
+    fee_summary = ', '.join(f'{amount} {asset}' for asset, amount in fees.items())
+    logger.warning(f"Purchased {quantity} {response['symbol']} @ {avg_fill_price} ({response['cummulativeQuoteQty']}). "
+                   f"Fees: {fee_summary}")
+    return response['cummulativeQuoteQty']
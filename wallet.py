@@ -1,16 +1,21 @@
-import logging, coloredlogs
-import telegram, config
+from decimal import Decimal
+
+import logs
+from schedule_store import Column, to_buffer_value
+
+logger = logs.get_logger(__name__)
 
-logger = logging.getLogger(__name__)
-coloredlogs.install(level='DEBUG')
-telegram_handler = telegram.TelegramHandler(config.TELEGRAM_USER_ID)
-telegram_handler.setLevel(logging.INFO)
-logger.addHandler(telegram_handler)
 
 class Wallet:
+    """A schedule's symbol and buffered DCA amount. Once its schedule is added to a Scheduler the buffer is a view
+    on the scheduler's ScheduleStore."""
     SPOT = 0
     EARN = 1
 
+    __slots__ = ('base_currency', 'quote_currency', 'symbol', 'store', 'row', '_buffered_dca_quote_value')
+
+    buffered_dca_quote_value = Column('buffer')
+
     def __init__(self,
                  base_currency,
                  quote_currency,
@@ -18,12 +23,12 @@ class Wallet:
         self.base_currency = base_currency
         self.quote_currency = quote_currency
         self.symbol = f"{base_currency}{quote_currency}"
-        self.buffered_dca_quote_value = buffered_dca_quote_value
+        self.store = None
+        self.row = None
+        self.buffered_dca_quote_value = to_buffer_value(buffered_dca_quote_value)
 
     def add_dca(self, amount):
-        # Round to account for floating point precision. 4 decimals should be enough given we're working with FIAT.
-        # May need upping to 6 or higher if we start using BTC or ETH as the quote currency.
-        new_amount = round((self.buffered_dca_quote_value + amount), 4)
+        new_amount = self.buffered_dca_quote_value + to_buffer_value(amount)
         logger.debug(f"Adding {amount} to {self.symbol} buffer. (Current total: {new_amount})")
         self.buffered_dca_quote_value = new_amount
         return self.buffered_dca_quote_value
@@ -41,5 +46,5 @@ class Wallet:
         return self.symbol
 
     def reset_buffer(self):
-        self.buffered_dca_quote_value = 0
-        return 0
\ No newline at end of file
+        self.buffered_dca_quote_value = Decimal(0)
+        return self.buffered_dca_quote_value
@@ -0,0 +1,36 @@
+import asyncio
+import signal
+
+import metrics, main, schedule_file, logs
+
+logger = logs.get_logger(__name__)
+
+# Seconds between health reports to the supervisor
+HEARTBEAT_INTERVAL = 15
+
+
+def health(scheduler):
+    schedules = []
+    for status in scheduler.status():
+        status['next_tick'] = status['next_tick'].isoformat()
+        schedules.append(status)
+    return schedules
+
+
+async def report_health(name, scheduler, events):
+    # Sent from the event loop, so a worker stuck on a blocking call goes quiet rather than reporting healthy
+    while True:
+        events.put(('heartbeat', name, {'schedules': health(scheduler),
+                                        'metrics': metrics.collect([('worker', name)])}))
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+async def run(name, schedules, events, schedules_path=None, select=None):
+    # Stop cleanly on SIGTERM from the supervisor so schedule state is saved on the way out
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    scheduler = await main.start_scheduler(schedules)
+    logger.debug(f'Worker {name} running {len(scheduler.schedules)} schedules')
+    tasks = [report_health(name, scheduler, events)]
+    if schedules_path is not None:
+        tasks.append(schedule_file.watch(scheduler, schedules_path, select))
+    await main.run(scheduler, *tasks)